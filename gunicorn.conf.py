@@ -0,0 +1,29 @@
+"""Gunicorn settings of ku-polls.
+
+The master process imports and warms the application once (preload_app)
+and every worker forked from it shares that memory; see polls.startup.
+Run it with ``gunicorn`` from the project directory, or for the async
+views with ``gunicorn -k uvicorn.workers.UvicornWorker mysite.asgi``.
+"""
+import multiprocessing
+import os
+
+from decouple import config
+
+wsgi_app = 'mysite.wsgi:application'
+bind = config('BIND', cast=str, default='127.0.0.1:8000')
+workers = config('WEB_CONCURRENCY', cast=int, default=multiprocessing.cpu_count() * 2 + 1)
+preload_app = True
+
+# Tell the settings how many processes share the caches.
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+
+def pre_fork(server, worker):
+    from polls import startup
+    startup.before_fork()
+
+
+def post_fork(server, worker):
+    from polls import startup
+    startup.after_fork()
@@ -0,0 +1,21 @@
+"""SQLite backend accepting the ``transaction_mode`` option of Django 5.1+.
+
+With ``'transaction_mode': 'IMMEDIATE'`` transactions take the write lock
+when they begin, so two votes never deadlock upgrading their read locks.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('transaction_mode', None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode:
+            self.cursor().execute(f'BEGIN {mode}')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os.path
 from pathlib import Path
+
+import django
 from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +56,7 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'polls.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -67,23 +70,151 @@ TEMPLATES = [
     },
 ]
 
+# Outside DEBUG, templates are compiled once per process by the cached
+# loader. TEMPLATE_WARMUP makes server processes import every view and
+# compile the polls and registration templates when they start, rather
+# than on their first requests.
+if not DEBUG:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+POLLS_TEMPLATE_WARMUP = config('TEMPLATE_WARMUP', cast=bool, default=not DEBUG)
+
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = config('DB_ENGINE', cast=str, default='sqlite3')
+
+if DB_ENGINE == 'sqlite3':
+    DATABASES = {
+        'default': {
+            # transaction_mode is built in from Django 5.1
+            'ENGINE': ('django.db.backends.sqlite3' if django.VERSION >= (5, 1)
+                       else 'mysite.backends.sqlite3'),
+            'NAME': config('DB_NAME', cast=str, default=str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {
+                # seconds to wait for the write lock before "database is locked"
+                'timeout': config('SQLITE_BUSY_TIMEOUT', cast=float, default=5.0),
+                # take the write lock when the transaction starts, so a vote
+                # never has to upgrade a read lock and deadlock another writer
+                'transaction_mode': config('SQLITE_TRANSACTION_MODE', cast=str,
+                                           default='IMMEDIATE'),
+            },
+        }
+    }
+else:
+    # postgresql, mysql or any other server backend
+    DATABASES = {
+        'default': {
+            'ENGINE': f'django.db.backends.{DB_ENGINE}',
+            'NAME': config('DB_NAME', cast=str, default='ku_polls'),
+            'USER': config('DB_USER', cast=str, default=''),
+            'PASSWORD': config('DB_PASSWORD', cast=str, default=''),
+            'HOST': config('DB_HOST', cast=str, default=''),
+            'PORT': config('DB_PORT', cast=str, default=''),
+            # keep connections open between requests, checked before reuse
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', cast=int, default=60),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
+    if config('DB_POOL', cast=bool, default=False):
+        # psycopg 3 connection pool, needs Django 5.1+ and psycopg[pool]
+        DATABASES['default']['OPTIONS']['pool'] = True
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Read replicas: comma separated database names (SQLite files or server
+# databases) with the same settings as default, used for index and results
+# reads. Nothing here replicates data into them.
+POLLS_READ_REPLICAS = []
+for index, name in enumerate(config('DB_REPLICAS', cast=Csv(), default=''), 1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'NAME': name,
+                                    'TEST': {'MIRROR': 'default'}}
+    POLLS_READ_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['polls.routers.ReplicaRouter']
+
+# Seconds a voter keeps reading from the primary after voting
+POLLS_REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', cast=int, default=5)
+
+# PRAGMAs run on every new SQLite connection by polls.signals.tune_sqlite
+SQLITE_PRAGMAS = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', cast=str, default='WAL'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', cast=str, default='NORMAL'),
+    'busy_timeout': int(config('SQLITE_BUSY_TIMEOUT', cast=float, default=5.0) * 1000),
+    'mmap_size': config('SQLITE_MMAP_SIZE', cast=int, default=256 * 1024 * 1024),
 }
 
 AUTHENTICATION_BACKENDS = [
-    # username/password authentication
-    'django.contrib.auth.backends.ModelBackend',
+    # username/password authentication, with session users cached
+    'polls.auth.CachedModelBackend',
 ]
 
+# Sessions
+# https://docs.djangoproject.com/en/4.1/topics/http/sessions/
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SESSION_ENGINE = SESSION_ENGINES[config('SESSION_BACKEND', cast=str, default='db')]
+
+# Write sessions only when they change, not on every request
+SESSION_SAVE_EVERY_REQUEST = False
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+# Server processes on this host; gunicorn.conf.py exports its worker count.
+# A local memory cache is private to one process, so votes and edits
+# handled by one worker would not invalidate the pages cached by the
+# others: with several processes the default is the file cache they share.
+POLLS_SERVER_PROCESSES = config('WEB_CONCURRENCY', cast=int, default=1)
+POLLS_CACHE_BACKEND = config('CACHE_BACKEND', cast=str,
+                             default='file' if POLLS_SERVER_PROCESSES > 1 else 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[POLLS_CACHE_BACKEND],
+        'LOCATION': config('CACHE_LOCATION', cast=str,
+                           default=os.path.join(BASE_DIR, 'cache')
+                           if POLLS_CACHE_BACKEND == 'file' else 'ku-polls'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', cast=int, default=1000),
+        },
+    }
+}
+
+# Seconds a logged-in user is cached between requests, 0 turns it off.
+# Saving a user only drops the cached copy of the process doing it, so by
+# default users are cached only in a cache shared by every process.
+POLLS_AUTH_CACHE_TIMEOUT = config('AUTH_CACHE_TIMEOUT', cast=int,
+                                  default=0 if POLLS_CACHE_BACKEND == 'locmem' else 300)
+
+# Seconds a rendered results page is kept, 0 turns the cache off
+POLLS_RESULTS_CACHE_TIMEOUT = config('RESULTS_CACHE_TIMEOUT', cast=int, default=300)
+
+# Upper bound in seconds on caching the index question list, 0 turns it off
+POLLS_INDEX_CACHE_TIMEOUT = config('INDEX_CACHE_TIMEOUT', cast=int, default=300)
+
+# Seconds shared caches such as a CDN may serve the index and results pages
+# of anonymous visitors before revalidating them
+POLLS_SHARED_CACHE_MAX_AGE = config('SHARED_CACHE_MAX_AGE', cast=int, default=5)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -117,11 +248,88 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = config('STATIC_ROOT', cast=str, default=str(BASE_DIR / 'staticfiles'))
+
+# With STATIC_MANIFEST, collectstatic names files by the hash of their
+# content, and they are served from STATIC_ROOT cached for a year
+POLLS_STATIC_MANIFEST = config('STATIC_MANIFEST', cast=bool, default=False)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': ('django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
+                    if POLLS_STATIC_MANIFEST
+                    else 'django.contrib.staticfiles.storage.StaticFilesStorage'),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Seconds a process trusts its remembered next question state transition
+# before checking again for questions edited elsewhere
+POLLS_LIFECYCLE_RECHECK_SECONDS = config('LIFECYCLE_RECHECK_SECONDS', cast=int, default=60)
+
+# Questions per archive page by default and at most
+POLLS_ARCHIVE_PAGE_SIZE = config('ARCHIVE_PAGE_SIZE', cast=int, default=20)
+POLLS_ARCHIVE_MAX_PAGE_SIZE = config('ARCHIVE_MAX_PAGE_SIZE', cast=int, default=100)
+
+# Most questions listed by a search
+POLLS_SEARCH_RESULTS = config('SEARCH_RESULTS', cast=int, default=20)
+
+# Polls routes served by their async views (index, detail, results, vote)
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', cast=Csv(), default='')
+
+# Update results pages live from the results stream (needs an ASGI server)
+POLLS_LIVE_RESULTS = config('LIVE_RESULTS', cast=bool, default=False)
+
+# Live results streams: seconds between tally messages, between keepalive
+# comments, and before the browser is asked to reconnect
+POLLS_SSE_TICK = config('SSE_TICK', cast=float, default=1.0)
+POLLS_SSE_KEEPALIVE = config('SSE_KEEPALIVE', cast=float, default=15.0)
+POLLS_SSE_MAX_SECONDS = config('SSE_MAX_SECONDS', cast=float, default=300.0)
+
+# Write-behind buffering of choice vote tallies
+POLLS_VOTE_BUFFER = {
+    'ENABLED': config('VOTE_BUFFER', cast=bool, default=False),
+    'SHARDS': config('VOTE_BUFFER_SHARDS', cast=int, default=8),
+    'FLUSH_INTERVAL': config('VOTE_BUFFER_FLUSH_INTERVAL', cast=float, default=1.0),
+    'MAX_PENDING': config('VOTE_BUFFER_MAX_PENDING', cast=int, default=10000),
+}
+
+# Token bucket limits of the vote view as "votes/seconds" per client IP,
+# per user and per user on one question, kept in this process (local) or
+# in the cache shared by every process (cache)
+POLLS_VOTE_RATE_LIMIT = {
+    'ENABLED': config('VOTE_RATE_LIMIT', cast=bool, default=True),
+    'STORE': config('VOTE_RATE_LIMIT_STORE', cast=str, default='local'),
+    'IP': config('VOTE_RATE_IP', cast=str, default='120/60'),
+    'USER': config('VOTE_RATE_USER', cast=str, default='30/60'),
+    'QUESTION': config('VOTE_RATE_QUESTION', cast=str, default='5/60'),
+}
+
+# Fraction of requests whose queries and timings are recorded per view, and
+# a bearer token letting a Prometheus scraper read /polls/metrics/
+POLLS_INSTRUMENTATION_SAMPLE_RATE = config('INSTRUMENTATION_SAMPLE_RATE', cast=float,
+                                           default=1.0 if DEBUG else 0.05)
+POLLS_METRICS_TOKEN = config('METRICS_TOKEN', cast=str, default='')
+
+# Bearer token of kiosks posting ballot batches to /polls/api/votes/bulk/,
+# and the largest batch accepted
+POLLS_API_TOKEN = config('API_TOKEN', cast=str, default='')
+POLLS_BULK_VOTE_MAX = config('BULK_VOTE_MAX', cast=int, default=5000)
+
+# Vote analytics at /polls/api/analytics/: most questions per report and
+# seconds a report is cached when no vote changes it
+POLLS_ANALYTICS_MAX_QUESTIONS = config('ANALYTICS_MAX_QUESTIONS', cast=int, default=20)
+POLLS_ANALYTICS_CACHE_TIMEOUT = config('ANALYTICS_CACHE_TIMEOUT', cast=int, default=300)
+
+# Most question ids fetched by one /polls/api/v1/questions/?ids= request
+POLLS_API_MAX_IDS = config('API_MAX_IDS', cast=int, default=100)
+
 LOGIN_REDIRECT_URL = '/polls/'    # show list of polls
 LOGOUT_REDIRECT_URL = '/'         # after logout, go where?
@@ -0,0 +1,27 @@
+"""
+Settings of public voting nodes.
+
+mysite.settings without the admin site, for server processes that only
+serve the polls pages and API and should start fast. The instrumentation
+middleware and template backend are left off when nothing is sampled.
+
+Select these settings with DJANGO_SETTINGS_MODULE=mysite.settings_public,
+and keep the admin and management commands on nodes running
+mysite.settings.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, POLLS_INSTRUMENTATION_SAMPLE_RATE, TEMPLATES
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'django.contrib.admin']
+
+# The debug context processor only adds to pages rendered with DEBUG.
+TEMPLATES = [{**TEMPLATES[0], 'OPTIONS': {
+    **TEMPLATES[0]['OPTIONS'],
+    'context_processors': [processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+                           if processor != 'django.template.context_processors.debug'],
+}}]
+
+if POLLS_INSTRUMENTATION_SAMPLE_RATE <= 0:
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+                  if middleware != 'polls.instrumentation.InstrumentationMiddleware']
+    TEMPLATES[0]['BACKEND'] = 'django.template.backends.django.DjangoTemplates'
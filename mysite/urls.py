@@ -13,15 +13,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import include, path
+from django.apps import apps
+from django.conf import settings
+from django.urls import include, path, re_path
 from django.views.generic.base import RedirectView
 from . import view
 
 urlpatterns = [
     path('polls/', include('polls.urls')),
-    path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
     path('signup/', view.signup, name='signup'),
     path('', RedirectView.as_view(url='polls/'))
 ]
+
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+    urlpatterns.append(path('admin/', admin.site.urls))
+
+if settings.POLLS_STATIC_MANIFEST:
+    urlpatterns.append(re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<path>.*)$', view.static))
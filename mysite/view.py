@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+# Seconds browsers keep static files named by their content hash.
+HASHED_STATIC_MAX_AGE = 365 * 24 * 60 * 60
 
 
 def signup(request):
@@ -8,10 +15,9 @@ def signup(request):
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
         if form.is_valid():
-            form.save()
-            username = form.cleaned_data.get('username')
-            raw_passwd = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=raw_passwd)
+            # The new user is logged in directly rather than through
+            # authenticate(), which would hash the password a second time.
+            user = form.save()
             login(request, user)
         return redirect('polls:index')
         # what if form is not valid?
@@ -19,3 +25,15 @@ def signup(request):
     else:
         form = UserCreationForm()
     return render(request, 'registration/signup.html', {'form': form})
+
+
+def static(request, path):
+    """Serve a collected static file from STATIC_ROOT. Files named by
+    their content hash never change, so they are cached for a year."""
+    response = serve(request, path, document_root=settings.STATIC_ROOT)
+    hashed = getattr(staticfiles_storage, 'hashed_files', {})
+    if path in hashed.values():
+        patch_cache_control(response, public=True, max_age=HASHED_STATIC_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -1,10 +1,19 @@
+import datetime
+
 from django.contrib import admin
-from .models import Question, Choice
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import search
+from .models import Question, Choice, Vote, VoteQuerySet
+from .pagination import EstimatedCountPaginator
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 3
+    readonly_fields = ['vote_count']
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -15,10 +24,96 @@ class QuestionAdmin(admin.ModelAdmin):
     ]
     inlines = [ChoiceInline]
     list_display = ('question_text', 'pub_date', 'end_date',
-                    'was_published_recently', 'is_published')
-    list_filter = ['pub_date', 'end_date']
+                    'was_published_recently', 'state', 'total_votes')
+    list_filter = ['state', 'pub_date', 'end_date']
     search_fields = ['question_text']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        """Annotate the vote total of each question from its choice tallies."""
+        totals = Choice.objects.filter(question=OuterRef('pk')).order_by() \
+            .values('question').annotate(total=Sum('vote_count')).values('total')
+        return super().get_queryset(request).annotate(
+            total_votes=Coalesce(Subquery(totals), 0))
+
+    @admin.display(ordering='total_votes', description='Votes')
+    def total_votes(self, question):
+        return question.total_votes
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search through the full-text index instead of a LIKE scan."""
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search.matching(search_term, using=queryset.db)), False
+
+
+class ChoiceAdmin(admin.ModelAdmin):
+    list_display = ('choice_text', 'question', 'vote_count')
+    list_select_related = ('question',)
+    raw_id_fields = ('question',)
+    readonly_fields = ('vote_count',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class IndexedDatesQuerySet(VoteQuerySet):
+    """VoteQuerySet whose datetimes() finds the periods of the admin date
+    hierarchy with one EXISTS range probe per candidate period between the
+    first and last rows, which an index on the field serves, instead of a
+    DISTINCT over a date function of every row."""
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, **kwargs):
+        if kind not in ('year', 'month', 'day') or kwargs:
+            return super().datetimes(field_name, kind, order, tzinfo, **kwargs)
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        start = timezone.localtime(bounds['first'], tzinfo).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        if kind != 'day':
+            start = start.replace(day=1)
+        if kind == 'year':
+            start = start.replace(month=1)
+        last = timezone.localtime(bounds['last'], tzinfo)
+        periods = []
+        while start <= last:
+            if kind == 'day':
+                end = start + datetime.timedelta(days=1)
+            elif kind == 'month' and start.month < 12:
+                end = start.replace(month=start.month + 1)
+            else:
+                end = start.replace(year=start.year + 1, month=1)
+            if self.filter(**{f'{field_name}__gte': start, f'{field_name}__lt': end}).exists():
+                periods.append(start)
+            start = end
+        return periods[::-1] if order == 'DESC' else periods
+
+
+class VoteAdmin(admin.ModelAdmin):
+    """Read-only list of votes. Votes are cast through Vote.cast, which
+    keeps the choice tallies and the one vote per question rule, so they
+    cannot be added or edited here."""
+    list_display = ('user', 'question', 'choice', 'voted_at', 'changes')
+    list_select_related = ('user', 'question', 'choice')
+    raw_id_fields = ('user', 'choice')
+    readonly_fields = ('question', 'voted_at', 'changed_at', 'changes')
+    date_hierarchy = 'voted_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return IndexedDatesQuerySet(queryset.model, queryset.query, queryset.db)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Question, QuestionAdmin)
-admin.site.register(Choice)
+admin.site.register(Choice, ChoiceAdmin)
+admin.site.register(Vote, VoteAdmin)
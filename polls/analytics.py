@@ -0,0 +1,169 @@
+"""Vectorized analytics over the votes of a set of questions.
+
+The votes are read once in columnar form, as NumPy arrays of question,
+choice and user ids, vote times and change counts. Every figure is then
+computed with array operations rather than per-vote Python loops.
+"""
+import datetime
+import math
+
+import numpy as np
+from django.utils import timezone
+
+from .models import Choice, Question, Vote
+
+
+class VoteColumns:
+    """The votes of some questions as parallel arrays."""
+
+    def __init__(self, question, choice, user, voted_at, changes):
+        self.question = question
+        self.choice = choice
+        self.user = user
+        self.voted_at = voted_at
+        self.changes = changes
+
+    def __len__(self):
+        return len(self.choice)
+
+    @classmethod
+    def load(cls, question_ids):
+        """Read the votes of the given questions."""
+        rows = Vote.objects.filter(question_id__in=question_ids).order_by() \
+            .values_list('question_id', 'choice_id', 'user_id', 'voted_at', 'changes')
+        question, choice, user, voted_at, changes = zip(*rows) if rows else ((),) * 5
+        return cls(
+            np.array(question, dtype=np.int64),
+            np.array(choice, dtype=np.int64),
+            np.array(user, dtype=np.int64),
+            # Epoch seconds, NaN for votes cast before times were recorded.
+            np.array([when.timestamp() if when else math.nan for when in voted_at],
+                     dtype=np.float64),
+            np.array(changes, dtype=np.int64),
+        )
+
+
+def _positions(values, keys):
+    """Return the index of every value in the sorted keys array."""
+    return np.searchsorted(keys, values)
+
+
+def percentages(columns, choice_ids, choice_questions):
+    """Return (counts, percentages) of the sorted choice_ids, as shares of
+    the votes of their question."""
+    counts = np.bincount(_positions(columns.choice, choice_ids),
+                         minlength=len(choice_ids)).astype(np.int64)
+    question_keys, question_index = np.unique(choice_questions, return_inverse=True)
+    totals = np.bincount(question_index, weights=counts,
+                         minlength=len(question_keys))[question_index]
+    shares = np.divide(counts * 100.0, totals, out=np.zeros(len(counts)), where=totals > 0)
+    return counts, shares
+
+
+def vote_curve(choice, voted_at, choice_ids, bucket_seconds, start, buckets):
+    """Return a (choices, buckets) array counting the votes first cast in
+    each bucket from start, by their current choice. Votes without a time
+    are left out."""
+    known = ~np.isnan(voted_at)
+    bucket = np.clip(((voted_at[known] - start) // bucket_seconds).astype(np.int64),
+                     0, buckets - 1)
+    cell = _positions(choice[known], choice_ids) * buckets + bucket
+    return np.bincount(cell, minlength=len(choice_ids) * buckets) \
+        .reshape(len(choice_ids), buckets)
+
+
+def cramers_v(first, second, first_size, second_size):
+    """Return Cramér's V of two aligned arrays of choice positions."""
+    if len(first) < 2 or first_size < 2 or second_size < 2:
+        return None
+    observed = np.bincount(first * second_size + second,
+                           minlength=first_size * second_size) \
+        .reshape(first_size, second_size).astype(np.float64)
+    rows, cols = observed.sum(axis=1), observed.sum(axis=0)
+    rows, cols = rows[rows > 0], cols[cols > 0]
+    observed = observed[observed.sum(axis=1) > 0][:, observed.sum(axis=0) > 0]
+    if min(observed.shape) < 2:
+        return None
+    expected = np.outer(rows, cols) / len(first)
+    chi2 = ((observed - expected) ** 2 / expected).sum()
+    return float(math.sqrt(chi2 / (len(first) * (min(observed.shape) - 1))))
+
+
+def correlations(columns, question_ids, choice_ids, choice_questions):
+    """Return the Cramér's V of the choices of every pair of questions,
+    over the users who voted on both."""
+    users, user_index = np.unique(columns.user, return_inverse=True)
+    question_index = _positions(columns.question, question_ids)
+    choice_index = _positions(columns.choice, choice_ids)
+    # Position of each choice among the choices of its question.
+    order = np.lexsort((choice_ids, choice_questions))
+    grouped = choice_questions[order]
+    local_choice = np.empty(len(choice_ids), dtype=np.int64)
+    local_choice[order] = np.arange(len(grouped)) - np.searchsorted(grouped, grouped)
+    sizes = np.bincount(_positions(choice_questions, question_ids), minlength=len(question_ids))
+    ballots = np.full((len(users), len(question_ids)), -1, dtype=np.int64)
+    ballots[user_index, question_index] = local_choice[choice_index]
+    pairs = []
+    for i in range(len(question_ids)):
+        for j in range(i + 1, len(question_ids)):
+            both = (ballots[:, i] >= 0) & (ballots[:, j] >= 0)
+            pairs.append({
+                'questions': [int(question_ids[i]), int(question_ids[j])],
+                'common_voters': int(both.sum()),
+                'cramers_v': cramers_v(ballots[both, i], ballots[both, j],
+                                       int(sizes[i]), int(sizes[j])),
+            })
+    return pairs
+
+
+def report(question_ids, bucket_seconds=3600, max_buckets=1000):
+    """Return the JSON-ready analytics of the given questions.
+
+    Vote curves run from the first timed vote of each question until now,
+    with buckets widened as needed to stay within max_buckets.
+    """
+    questions = list(Question.objects.filter(pk__in=question_ids).order_by('pk'))
+    question_ids = np.array([question.pk for question in questions], dtype=np.int64)
+    choice_rows = list(Choice.objects.filter(question_id__in=question_ids)
+                       .order_by('pk').values_list('pk', 'question_id'))
+    choice_ids = np.array([pk for pk, _ in choice_rows], dtype=np.int64)
+    choice_questions = np.array([question_id for _, question_id in choice_rows], dtype=np.int64)
+    columns = VoteColumns.load(question_ids)
+
+    counts, shares = percentages(columns, choice_ids, choice_questions)
+    now = timezone.now().timestamp()
+    result = {'questions': []}
+    for question in questions:
+        mine = choice_questions == question.pk
+        votes = columns.question == question.pk
+        voted_at = columns.voted_at[votes]
+        changes = columns.changes[votes]
+        timed = voted_at[~np.isnan(voted_at)]
+        width = bucket_seconds
+        if len(timed):
+            start = float(timed.min())
+            width = max(width, math.ceil((now - start) / max_buckets))
+            start -= start % width
+            buckets = max(1, math.ceil((now - start) / width))
+            curve = vote_curve(columns.choice[votes], voted_at, choice_ids[mine],
+                               width, start, buckets)
+            start = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).isoformat()
+        else:
+            start, curve = None, np.zeros((int(mine.sum()), 0), dtype=np.int64)
+        result['questions'].append({
+            'id': question.pk,
+            'question_text': question.question_text,
+            'votes': int(votes.sum()),
+            'votes_without_time': int(len(voted_at) - len(timed)),
+            'changed_votes': int((changes > 0).sum()),
+            'vote_changes': int(changes.sum()),
+            'choices': [{'id': int(pk), 'votes': int(count), 'percentage': round(float(share), 2)}
+                        for pk, count, share in zip(choice_ids[mine], counts[mine], shares[mine])],
+            'curve': {
+                'start': start,
+                'bucket_seconds': width,
+                'counts': {str(pk): row.tolist() for pk, row in zip(choice_ids[mine], curve)},
+            },
+        })
+    result['correlations'] = correlations(columns, question_ids, choice_ids, choice_questions)
+    return result
@@ -0,0 +1,299 @@
+"""JSON endpoints of the polls app."""
+import hmac
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import cache
+from .buffer import get_tally_buffer
+from .models import Choice, Question, Vote
+from .pagination import keyset_page
+from .routers import replica_view
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BALLOT_FIELDS = ('user', 'question', 'choice')
+
+# Fields of the read API. Question fields map to the model fields they
+# read; "choices" selects every choice field.
+QUESTION_FIELDS = {
+    'id': 'pk',
+    'question_text': 'question_text',
+    'pub_date': 'pub_date',
+    'end_date': 'end_date',
+    'state': 'state',
+    'total_votes': None,
+}
+CHOICE_FIELDS = ('id', 'choice_text', 'votes')
+LIST_FIELDS = 'id,question_text,pub_date,end_date,state'
+DETAIL_FIELDS = f'{LIST_FIELDS},choices.id,choices.choice_text'
+RESULTS_FIELDS = 'id,question_text,total_votes,choices'
+
+
+def _has_token(request, token):
+    """Return whether the request carries token as its bearer token,
+    compared in constant time."""
+    return bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+
+
+def _authenticate(request):
+    """Return an error response unless the request carries POLLS_API_TOKEN
+    or comes from a staff session with a valid CSRF token."""
+    if _has_token(request, settings.POLLS_API_TOKEN):
+        return None
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff login or API token required.'}, status=403)
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+
+
+def _ballot(item):
+    if not isinstance(item, dict):
+        return None
+    values = tuple(item.get(name) for name in BALLOT_FIELDS)
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return None
+    return values
+
+
+def _check_ballots(ballots):
+    """Check the users, choices and voting windows of ballots with one
+    query each. Return the list of results, None for the accepted ballots,
+    and the accepted {(user, question): (index, choice)}, where a later
+    ballot of a user on a question supersedes an earlier one."""
+    valid = [ballot for ballot in ballots if ballot is not None]
+    users = set(User.objects.filter(pk__in={user for user, _, _ in valid}, is_active=True)
+                .values_list('pk', flat=True))
+    choices = dict(Choice.objects.filter(pk__in={choice for _, _, choice in valid})
+                   .values_list('pk', 'question_id'))
+    open_questions = set(Question.objects.filter(
+        pk__in={question for _, question, _ in valid}, state=Question.State.OPEN,
+    ).values_list('pk', flat=True))
+
+    results = []
+    accepted = {}
+    for index, ballot in enumerate(ballots):
+        if ballot is None:
+            error = 'invalid'
+        else:
+            user, question, choice = ballot
+            if user not in users:
+                error = 'unknown_user'
+            elif choices.get(choice) != question:
+                error = 'unknown_choice'
+            elif question not in open_questions:
+                error = 'closed'
+            else:
+                previous = accepted.get((user, question))
+                if previous is not None:
+                    results[previous[0]] = {'status': 'superseded'}
+                accepted[user, question] = (index, choice)
+                error = None
+        results.append({'status': 'rejected', 'error': error} if error else None)
+    return results, accepted
+
+
+@csrf_exempt
+@require_POST
+def bulk_vote(request):
+    """Record a batch of votes posted as
+    ``{"votes": [{"user": 1, "question": 2, "choice": 3}, ...]}``.
+
+    Users, choices and voting windows are checked with one query each and
+    the accepted votes are written in one transaction, which checks the
+    voting windows again. A later ballot of the same user on the same
+    question supersedes an earlier one. The response holds one result per
+    ballot, in order.
+    """
+    denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    try:
+        items = json.loads(request.body)['votes']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON object with a "votes" list.'}, status=400)
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'Expected a JSON object with a "votes" list.'}, status=400)
+    if len(items) > settings.POLLS_BULK_VOTE_MAX:
+        return JsonResponse({'error': f'At most {settings.POLLS_BULK_VOTE_MAX} votes per request.'},
+                            status=413)
+
+    Question.catch_up()
+    results, accepted = _check_ballots([_ballot(item) for item in items])
+    try:
+        statuses = Vote.cast_many({key: choice for key, (_, choice) in accepted.items()},
+                                  open_only=True)
+    except IntegrityError:
+        # A concurrent request created one of the votes first.
+        return JsonResponse({'error': 'Conflicting concurrent votes, retry the batch.'},
+                            status=409)
+    for key, (index, _) in accepted.items():
+        # A question may have closed since the ballots were checked.
+        results[index] = ({'status': 'rejected', 'error': 'closed'} if statuses[key] == 'closed'
+                          else {'status': statuses[key]})
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return JsonResponse({'summary': summary, 'results': results})
+
+
+@require_GET
+def vote_analytics(request):
+    """Return the vote analytics of the questions listed in the questions
+    query parameter (``?questions=1,2,3&bucket=3600``) to staff or to
+    POLLS_API_TOKEN holders. Reports are cached until one of the questions
+    gets a vote."""
+    denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    try:
+        question_ids = sorted({int(pk) for pk in request.GET.get('questions', '').split(',') if pk})
+        bucket_seconds = int(request.GET.get('bucket', 3600))
+    except ValueError:
+        return JsonResponse({'error': 'questions must be comma separated ids and bucket '
+                                      'a number of seconds.'}, status=400)
+    limit = settings.POLLS_ANALYTICS_MAX_QUESTIONS
+    if not question_ids or len(question_ids) > limit or bucket_seconds < 1:
+        return JsonResponse({'error': f'Give between 1 and {limit} questions and a positive '
+                                      'bucket.'}, status=400)
+    key = cache.analytics_key(question_ids, bucket_seconds)
+    data = cache.get_analytics(key)
+    if data is None:
+        # Imported here so NumPy only loads in processes serving reports.
+        from . import analytics
+        data = analytics.report(question_ids, bucket_seconds)
+        cache.set_analytics(key, data)
+    return JsonResponse(data)
+
+
+def _json(data, status=200):
+    """Return data as a JSON response, encoded with orjson when installed."""
+    if orjson is None:
+        return JsonResponse(data, status=status)
+    return HttpResponse(orjson.dumps(data), status=status, content_type='application/json')
+
+
+def _fields(request, default):
+    """Return the question and choice fields named by the fields query
+    parameter, or by default. Raise ValueError on unknown names."""
+    question_fields, choice_fields = [], []
+    for name in request.GET.get('fields', default).split(','):
+        if name == 'choices':
+            choice_fields.extend(CHOICE_FIELDS)
+        elif name.startswith('choices.') and name[8:] in CHOICE_FIELDS:
+            choice_fields.append(name[8:])
+        elif name in QUESTION_FIELDS:
+            question_fields.append(name)
+        else:
+            raise ValueError(f'Unknown field {name!r}.')
+    return list(dict.fromkeys(question_fields)), list(dict.fromkeys(choice_fields))
+
+
+def _serialize(questions, question_fields, choice_fields):
+    """Return the JSON-ready dicts of questions with one more query for
+    their choices when choice fields or vote totals are asked for."""
+    choices = {question.pk: [] for question in questions}
+    if choice_fields or 'total_votes' in question_fields:
+        tally_buffer = get_tally_buffer()
+        for question_id, pk, choice_text, votes in Choice.objects.filter(
+                question_id__in=choices).order_by('pk').values_list(
+                'question_id', 'pk', 'choice_text', 'vote_count'):
+            if tally_buffer is not None:
+                votes += tally_buffer.pending(pk)
+            choices[question_id].append({'id': pk, 'choice_text': choice_text, 'votes': votes})
+    data = []
+    for question in questions:
+        item = {}
+        for name in question_fields:
+            if name == 'total_votes':
+                item[name] = sum(choice['votes'] for choice in choices[question.pk])
+            else:
+                value = getattr(question, QUESTION_FIELDS[name])
+                item[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+        if choice_fields:
+            item['choices'] = [{name: choice[name] for name in choice_fields}
+                               for choice in choices[question.pk]]
+        data.append(item)
+    return data
+
+
+def _published(question_fields):
+    columns = {QUESTION_FIELDS[name] for name in question_fields if QUESTION_FIELDS[name]}
+    return Question.objects.exclude(state=Question.State.SCHEDULED).only(
+        'pub_date', *(columns - {'pk'}))
+
+
+@require_GET
+@replica_view
+def questions(request):
+    """List published questions, newest first, a page at a time
+    (``?size=20&after=<cursor>``), or the questions of the ids query
+    parameter (``?ids=1,2,3``) in that order. The fields query parameter
+    picks the fields returned, such as ``fields=id,choices.votes``. A
+    request costs one query for the questions and one for their choices,
+    whatever the number of questions."""
+    try:
+        question_fields, choice_fields = _fields(request, LIST_FIELDS)
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+        size = min(int(request.GET.get('size', settings.POLLS_ARCHIVE_PAGE_SIZE)),
+                   settings.POLLS_ARCHIVE_MAX_PAGE_SIZE)
+    except ValueError as error:
+        return _json({'error': str(error)}, status=400)
+    if len(ids) > settings.POLLS_API_MAX_IDS:
+        return _json({'error': f'At most {settings.POLLS_API_MAX_IDS} ids per request.'},
+                     status=400)
+    Question.catch_up()
+    queryset = _published(question_fields)
+    if ids:
+        found = queryset.in_bulk(ids)
+        return _json({
+            'questions': _serialize([found[pk] for pk in dict.fromkeys(ids) if pk in found],
+                                    question_fields, choice_fields),
+            'missing': [pk for pk in dict.fromkeys(ids) if pk not in found],
+        })
+    try:
+        page = keyset_page(queryset, max(size, 1), after=request.GET.get('after'),
+                           before=request.GET.get('before'))
+    except ValueError as error:
+        return _json({'error': str(error)}, status=400)
+    return _json({
+        'questions': _serialize(page.items, question_fields, choice_fields),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def _question(request, pk, default):
+    try:
+        question_fields, choice_fields = _fields(request, default)
+    except ValueError as error:
+        return _json({'error': str(error)}, status=400)
+    Question.catch_up()
+    question = _published(question_fields).filter(pk=pk).first()
+    if question is None:
+        raise Http404('No question matches the given query.')
+    return _json(_serialize([question], question_fields, choice_fields)[0])
+
+
+@require_GET
+@replica_view
+def question(request, pk):
+    """Return a published question with its choices."""
+    return _question(request, pk, DETAIL_FIELDS)
+
+
+@require_GET
+@replica_view
+def question_results(request, pk):
+    """Return the vote counts of a published question."""
+    return _question(request, pk, RESULTS_FIELDS)
@@ -0,0 +1,164 @@
+"""Native async variants of the polls views.
+
+They render the same templates as polls.views but read through the async
+ORM and cache APIs, so under an ASGI server a request waiting on the
+database or on a file cache does not block the event loop. Routes listed
+in POLLS_ASYNC_VIEWS use these views instead of the sync ones.
+results_stream has no sync counterpart.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.cache import add_never_cache_headers
+from django.views import View
+
+from . import cache, conditional, events, ratelimit
+from .models import Choice, Question, Vote
+from .routers import ReplicaReadMixin, is_pinned, pin_to_primary
+
+
+async def _load_user(request):
+    """Resolve request.user off the event loop and return it."""
+    request.user = await sync_to_async(get_user)(request)
+    return request.user
+
+
+async def _aget_question(pk):
+    try:
+        return await Question.objects.prefetch_related('choice_set').aget(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404('No question matches the given query.')
+
+
+class AsyncIndexView(ReplicaReadMixin, View):
+    """Index page of application."""
+
+    async def get(self, request):
+        """Render the last five published questions, cached like IndexView."""
+        await _load_user(request)
+        await Question.acatch_up()
+        pinned = is_pinned(request)
+        version = await cache.aversion(cache.INDEX)
+        questions = None if pinned else await cache.aget_index(version)
+        if questions is None:
+            questions = [question async for question in Question.objects.exclude(
+                state=Question.State.SCHEDULED
+            ).order_by('-pub_date')[:5]]
+            if not pinned:
+                await cache.aset_index(version, questions, float('inf'))
+        if messages.get_messages(request):
+            response = render(request, 'polls/index.html', {'latest_question_list': questions})
+            add_never_cache_headers(response)
+            return response
+        private = request.user.is_authenticated
+        etag = conditional.index_etag(questions, request.user)
+        response = conditional.not_modified(request, etag, private=private)
+        if response is None:
+            response = render(request, 'polls/index.html', {'latest_question_list': questions})
+            conditional.add_validators(response, etag, private=private)
+        return response
+
+
+class AsyncDetailView(View):
+    """Detail page of application."""
+
+    async def get(self, request, pk):
+        """Return different pages in accordance to the question state"""
+        user = await _load_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        await Question.acatch_up()
+        question = await _aget_question(pk)
+        if question.state == Question.State.SCHEDULED:
+            messages.error(request, 'This poll not publish yet.')
+            return HttpResponseRedirect(reverse('polls:index'))
+        elif question.state == Question.State.CLOSED:
+            messages.error(request, 'This poll is ended.')
+            return HttpResponseRedirect(reverse('polls:index'))
+        check = await Vote.objects.filter(
+            user=user, question=question
+        ).values_list('choice_id', flat=True).afirst()
+        return render(request, 'polls/detail.html',
+                      {'question': question, 'check': check, })
+
+
+class AsyncResultsView(ReplicaReadMixin, View):
+    """Result page of the application."""
+
+    async def get(self, request, pk):
+        """Return the results page, served from the results cache and
+        revalidated like ResultsView when no messages are pending and the
+        client is not pinned to the primary."""
+        has_messages = bool(messages.get_messages(request))
+        pinned = is_pinned(request)
+        version = await cache.aresults_version(pk)
+        etag = conditional.results_etag(pk, version, primary=pinned)
+        if not has_messages and not pinned:
+            content = await cache.aget_results_page(pk, version)
+            if content is not None:
+                return conditional.not_modified(request, etag) or \
+                    conditional.add_validators(HttpResponse(content), etag)
+        await Question.acatch_up()
+        question = await _aget_question(pk)
+        if question.state == Question.State.SCHEDULED:
+            messages.error(request, 'This poll not publish yet.')
+            return HttpResponseRedirect(reverse('polls:index'))
+        if not has_messages:
+            response = conditional.not_modified(request, etag)
+            if response is not None:
+                return response
+        response = render(request, 'polls/results.html', {
+            'question': question, 'live_results': events.live(request)})
+        if has_messages:
+            add_never_cache_headers(response)
+            return response
+        if not pinned:
+            await cache.aset_results_page(pk, version, response.content)
+        return conditional.add_validators(response, etag)
+
+
+async def vote(request, question_id):
+    """Add vote to choice of the current question."""
+    throttled = await sync_to_async(ratelimit.throttle)(request, question_id)
+    if throttled is not None:
+        return throttled
+    user = await _load_user(request)
+    await Question.acatch_up()
+    state = await Question.objects.filter(pk=question_id).values_list('state', flat=True).afirst()
+    if state is None:
+        raise Http404('No question matches the given query.')
+    if state != Question.State.OPEN:
+        messages.error(request, 'This poll is ended.' if state == Question.State.CLOSED
+                       else 'This poll not publish yet.')
+        return HttpResponseRedirect(reverse('polls:index'))
+    try:
+        selected_choice = await Choice.objects.aget(
+            pk=request.POST['choice'], question_id=question_id)
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        return render(request, 'polls/detail.html', {
+            'question': await _aget_question(question_id),
+            'error_message': "You didn't select a choice.",
+        })
+    await sync_to_async(Vote.cast)(user, selected_choice)
+    return pin_to_primary(HttpResponseRedirect(reverse('polls:results', args=(question_id,))))
+
+
+async def results_stream(request, pk):
+    """Stream the live tallies of a published question as Server-Sent Events.
+    Only served over ASGI with POLLS_LIVE_RESULTS on; WSGI cannot hold the
+    connection open."""
+    if not events.live(request):
+        raise Http404('Live results are off.')
+    await Question.acatch_up()
+    question = await _aget_question(pk)
+    if question.state == Question.State.SCHEDULED:
+        raise Http404('No question matches the given query.')
+    response = StreamingHttpResponse(events.stream(question.pk),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,20 @@
+"""Authentication backend that keeps session users in the cache."""
+from django.contrib.auth.backends import ModelBackend
+
+from . import cache
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user(), run by AuthenticationMiddleware on
+    every logged-in request, reads the user from the cache. Saving or
+    deleting a user drops the cached copy; rows changed with update()
+    stay cached for up to POLLS_AUTH_CACHE_TIMEOUT seconds."""
+
+    def get_user(self, user_id):
+        version = cache.user_version(user_id)
+        user = cache.get_user(user_id, version)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set_user(user, version)
+        return user
@@ -0,0 +1,288 @@
+"""Load-testing harness for the polls request paths.
+
+seed() fills the database with synthetic polls, users and votes, and
+run() drives the polls URLs through the Django test client from a pool of
+worker threads, or through the ASGI handler from concurrent coroutines.
+The report is a JSON-ready dict of latency percentiles, throughput and
+queries per request for each endpoint, so runs from different commits
+can be diffed.
+"""
+import asyncio
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Choice, Question, Vote
+
+ENDPOINTS = ('index', 'detail', 'results', 'vote')
+
+# Run by cold_start() in a fresh interpreter: load the WSGI application the
+# way a server process starts, then time its first and second request.
+COLD_START = """
+import json
+import sys
+import time
+
+
+def fetch(application, path):
+    from django.test.client import RequestFactory
+    statuses = []
+    begun = time.perf_counter()
+    b''.join(application(RequestFactory().get(path).environ,
+                         lambda status, headers: statuses.append(int(status[:3]))))
+    return time.perf_counter() - begun, statuses[0]
+
+
+def main(path):
+    started = time.perf_counter()
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+    application = import_string(settings.WSGI_APPLICATION)
+    loaded = time.perf_counter()
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    first, status = fetch(application, path)
+    second, _ = fetch(application, path)
+    print(json.dumps({'startup': loaded - started, 'first': first, 'second': second,
+                      'status': status}))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
+"""
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(questions=100, choices=4, users=100, votes=1000, batch_size=5000):
+    """Create synthetic questions, choices, users and votes.
+
+    About a tenth of the questions are scheduled in the future and a tenth
+    have ended. Each vote goes to a distinct (user, question) pair, so
+    votes may not exceed users * questions.
+    """
+    if votes > users * questions:
+        raise ValueError('votes must not exceed users * questions')
+    rng = random.Random(0)
+    now = timezone.now()
+
+    def make_question(i):
+        if i % 10 == 1:
+            return Question(question_text=f'Upcoming question {i}',
+                            pub_date=now + datetime.timedelta(days=rng.randint(1, 30)))
+        pub_date = now - datetime.timedelta(days=rng.randint(1, 365))
+        end_date = now - datetime.timedelta(hours=1) if i % 10 == 2 else None
+        return Question(question_text=f'Benchmark question {i}',
+                        pub_date=pub_date, end_date=end_date)
+
+    for batch in _batches(map(make_question, range(questions)), batch_size):
+        Question.objects.bulk_create(batch)
+    Question.sync_states()
+    question_ids = list(Question.objects.order_by('pk').values_list('pk', flat=True))
+
+    choice_rows = ((question_id, n) for question_id in question_ids for n in range(choices))
+    for batch in _batches(choice_rows, batch_size):
+        Choice.objects.bulk_create(Choice(question_id=question_id, choice_text=f'Choice {n}')
+                                   for question_id, n in batch)
+    choice_ids = {}
+    for question_id, choice_id in Choice.objects.order_by('pk').values_list('question_id', 'pk'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+
+    password = make_password('benchmark')
+    for batch in _batches(range(users), batch_size):
+        User.objects.bulk_create(User(username=f'bench-user-{i}', password=password)
+                                 for i in batch)
+    user_ids = list(User.objects.filter(username__startswith='bench-user-')
+                    .order_by('pk').values_list('pk', flat=True))
+
+    def make_vote(i):
+        user_index, round_ = i % len(user_ids), i // len(user_ids)
+        question_id = question_ids[(user_index + round_) % len(question_ids)]
+        return Vote(user_id=user_ids[user_index], question_id=question_id,
+                    choice_id=rng.choice(choice_ids[question_id]))
+
+    for batch in _batches(map(make_vote, range(votes)), batch_size):
+        Vote.objects.bulk_create(batch)
+    Choice.rebuild_tallies()
+    return {'questions': len(question_ids), 'choices': choices * len(question_ids),
+            'users': len(user_ids), 'votes': votes}
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of already sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class _Target:
+    """Picks request arguments for one endpoint."""
+
+    def __init__(self, name, rng):
+        self.name = name
+        self.rng = rng
+        now = timezone.now()
+        published = Question.objects.filter(pub_date__lte=now)
+        self.open_ids = list(published.exclude(end_date__lt=now).values_list('pk', flat=True))
+        self.published_ids = list(published.values_list('pk', flat=True))
+        self.choice_ids = {}
+        if name == 'vote':
+            for question_id, choice_id in Choice.objects.filter(
+                    question_id__in=self.open_ids).values_list('question_id', 'pk'):
+                self.choice_ids.setdefault(question_id, []).append(choice_id)
+            self.open_ids = list(self.choice_ids)
+
+    @property
+    def needs_login(self):
+        return self.name in ('detail', 'vote')
+
+    def request(self, client):
+        if self.name == 'index':
+            return client.get(reverse('polls:index'))
+        if self.name == 'results':
+            return client.get(reverse('polls:results',
+                                      args=(self.rng.choice(self.published_ids),)))
+        question_id = self.rng.choice(self.open_ids)
+        if self.name == 'detail':
+            return client.get(reverse('polls:detail', args=(question_id,)))
+        return client.post(reverse('polls:vote', args=(question_id,)),
+                           {'choice': self.rng.choice(self.choice_ids[question_id])})
+
+
+def _worker(target, requests, user, pooled):
+    client = Client(raise_request_exception=False)
+    if target.needs_login:
+        client.force_login(user)
+    samples = []
+    try:
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = target.request(client)
+                elapsed = time.perf_counter() - started
+            samples.append((elapsed, len(queries), response.status_code >= 400))
+    finally:
+        if pooled:
+            connections.close_all()
+    return samples
+
+
+async def _async_worker(target, requests, client):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await target.request(client)
+        samples.append((time.perf_counter() - started, None, response.status_code >= 400))
+    return samples
+
+
+def _drive_asgi(target, share, users):
+    clients = []
+    for user in users:
+        client = AsyncClient(raise_request_exception=False)
+        if target.needs_login:
+            client.force_login(user)
+        clients.append(client)
+
+    async def main():
+        return await asyncio.gather(*map(_async_worker, [target] * len(share), share, clients))
+
+    return [sample for result in asyncio.run(main()) for sample in result]
+
+
+def run(endpoints=ENDPOINTS, requests=200, concurrency=4, seed_value=0, asgi=False,
+        session_engine=None):
+    """Drive every endpoint and return the report dict.
+
+    By default requests go through the WSGI handler from concurrency
+    worker threads. With asgi, they go through the ASGI handler from
+    concurrency coroutines on one event loop, the way an ASGI server runs
+    them; queries are not counted in that mode. Each worker logs in as its
+    own user, so at least concurrency users must exist. Vote rate limits
+    are turned off for the run. The detail and vote requests are the
+    authenticated ones; session_engine overrides SESSION_ENGINE to compare
+    their queries per request across session stores.
+    """
+    if session_engine is not None:
+        with override_settings(SESSION_ENGINE=session_engine):
+            return run(endpoints, requests, concurrency, seed_value, asgi)
+    if settings.POLLS_VOTE_RATE_LIMIT['ENABLED']:
+        # Every worker votes from one address far faster than the limits.
+        with override_settings(POLLS_VOTE_RATE_LIMIT={**settings.POLLS_VOTE_RATE_LIMIT,
+                                                      'ENABLED': False}):
+            return run(endpoints, requests, concurrency, seed_value, asgi)
+    rng = random.Random(seed_value)
+    users = list(User.objects.order_by('pk')[:concurrency])
+    report = {'endpoints': {}}
+    for name in endpoints:
+        target = _Target(name, rng)
+        share = [requests // concurrency + (i < requests % concurrency)
+                 for i in range(concurrency)]
+        started = time.perf_counter()
+        if asgi:
+            samples = _drive_asgi(target, share, users)
+        elif concurrency == 1:
+            samples = _worker(target, requests, users[0], pooled=False)
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                results = pool.map(_worker, [target] * concurrency, share,
+                                   users, [True] * concurrency)
+                samples = [sample for result in results for sample in result]
+        wall = time.perf_counter() - started
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        queries = [sample[1] for sample in samples if sample[1] is not None]
+        report['endpoints'][name] = {
+            'requests': len(samples),
+            'errors': sum(sample[2] for sample in samples),
+            'requests_per_second': len(samples) / wall if wall else None,
+            'latency_ms': {
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'mean': sum(latencies) / len(latencies) if latencies else None,
+            },
+            'queries_per_request': sum(queries) / len(queries) if queries else None,
+        }
+    return report
+
+
+def cold_start(path='/polls/', runs=3, env=None):
+    """Start runs fresh server processes with the extra environment
+    variables env and return the median seconds each took to load the
+    application, to answer its first request (the time to first byte of a
+    cold worker) and to answer a second one."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', COLD_START, path], check=True,
+                                capture_output=True, text=True, cwd=settings.BASE_DIR,
+                                env={**os.environ, **(env or {})}).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    report = {name: statistics.median(sample[name] * 1000 for sample in samples)
+              for name in ('startup', 'first', 'second')}
+    report = {f'{name}_ms': value for name, value in report.items()}
+    report['errors'] = sum(sample['status'] >= 400 for sample in samples)
+    return report
@@ -0,0 +1,219 @@
+"""Write-behind buffer for choice vote tallies.
+
+When enabled through ``POLLS_VOTE_BUFFER``, tally changes from committed
+votes are summed in memory across a number of lock shards and written to
+the database in one batch per flush interval. Vote rows are still written
+synchronously, so the unique (user, question) constraint keeps guarding
+one vote per user per question; only the counters are deferred.
+"""
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+class _Shard:
+    """A lock protecting part of the buffered deltas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deltas = Counter()
+        self.oldest = None
+
+
+class VoteCounterBuffer:
+    """Sharded in-memory sum of {choice_id: delta} waiting to be flushed.
+
+    apply is called with the merged deltas on every flush. Each writer
+    thread uses its own shard, so concurrent votes on the same choice do
+    not contend on one lock.
+    """
+
+    def __init__(self, apply, shards=8, flush_interval=1.0,
+                 max_pending=10000, autostart=True):
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.autostart = autostart
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._local = threading.local()
+        self._turns = itertools.count()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_at = None
+        self.last_flush_duration = 0.0
+
+    def _shard(self):
+        # Thread idents are aligned addresses and share their low bits, so
+        # each writer thread takes the next shard in turn instead.
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._turns) % len(self._shards)]
+        return shard
+
+    def add(self, deltas):
+        """Buffer the deltas, or apply them directly when the flusher is
+        not running or the buffer is full."""
+        if self.autostart and not self.start():
+            self.apply(deltas)
+            return
+        shard = self._shard()
+        with shard.lock:
+            shard.deltas.update(deltas)
+            if shard.oldest is None:
+                shard.oldest = time.monotonic()
+        if self.pending_count() >= self.max_pending:
+            self.flush()
+
+    def pending(self, choice_id):
+        """Return the delta of choice_id not yet written to the database."""
+        return sum(shard.deltas.get(choice_id, 0) for shard in self._shards)
+
+    def pending_count(self):
+        """Return the number of buffered choice deltas."""
+        return sum(len(shard.deltas) for shard in self._shards)
+
+    def _drain(self):
+        merged = Counter()
+        for shard in self._shards:
+            with shard.lock:
+                merged.update(shard.deltas)
+                shard.deltas = Counter()
+                shard.oldest = None
+        return {pk: delta for pk, delta in merged.items() if delta}
+
+    def flush(self):
+        """Write every buffered delta in one batch. Return the number of
+        choices touched."""
+        with self._flush_lock:
+            deltas = self._drain()
+            if not deltas:
+                return 0
+            started = time.monotonic()
+            try:
+                self.apply(deltas)
+            except Exception:
+                self.flush_errors += 1
+                logger.exception('Vote tally flush failed, keeping deltas.')
+                shard = self._shard()
+                with shard.lock:
+                    shard.deltas.update(deltas)
+                    shard.oldest = shard.oldest or started
+                return 0
+            self.flushes += 1
+            self.last_flush_at = time.time()
+            self.last_flush_duration = time.monotonic() - started
+            return len(deltas)
+
+    def start(self):
+        """Start the flusher thread of this process if needed. Return
+        whether a flusher is running."""
+        if self._thread is not None and self._thread.is_alive() \
+                and self._pid == os.getpid():
+            return True
+        try:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='vote-tally-flusher')
+            self._thread.start()
+        except RuntimeError:
+            logger.exception('Could not start the vote tally flusher.')
+            self._thread = None
+            return False
+        self._pid = os.getpid()
+        return True
+
+    def stop(self):
+        """Stop the flusher thread and write what is left."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(self.flush_interval * 2)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            close_old_connections()
+            self.flush()
+        close_old_connections()
+
+    def metrics(self):
+        """Return buffer health figures for monitoring."""
+        oldest = [shard.oldest for shard in self._shards if shard.oldest is not None]
+        return {
+            'buffered_deltas': self.pending_count(),
+            'buffered_votes': sum(abs(delta) for shard in self._shards
+                                  for delta in shard.deltas.values()),
+            'flush_lag_seconds': time.monotonic() - min(oldest) if oldest else 0.0,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_duration_seconds': self.last_flush_duration,
+            'flusher_running': self._thread is not None and self._thread.is_alive(),
+        }
+
+
+_tally_buffer = None
+
+
+def _apply_tallies(deltas):
+    from .models import Choice
+    from .signals import tallies_changed
+    with transaction.atomic():
+        Choice.adjust_tallies(deltas)
+        question_ids = set(Choice.objects.filter(pk__in=deltas)
+                           .values_list('question_id', flat=True))
+    tallies_changed.send(sender=Choice, question_ids=question_ids)
+
+
+def get_tally_buffer():
+    """Return the process tally buffer, or None when write-behind is off."""
+    global _tally_buffer
+    options = getattr(settings, 'POLLS_VOTE_BUFFER', {})
+    if not options.get('ENABLED'):
+        return None
+    if _tally_buffer is None:
+        _tally_buffer = VoteCounterBuffer(
+            _apply_tallies,
+            shards=options.get('SHARDS', 8),
+            flush_interval=options.get('FLUSH_INTERVAL', 1.0),
+            max_pending=options.get('MAX_PENDING', 10000),
+        )
+        atexit.register(_tally_buffer.stop)
+    return _tally_buffer
+
+
+def forget_tally_buffer(flush=True):
+    """Drop the process tally buffer, writing its pending tallies first
+    if flush. A forked worker drops the copy of its parent's buffer
+    without flushing, since the parent still owns those tallies."""
+    global _tally_buffer
+    if _tally_buffer is not None:
+        atexit.unregister(_tally_buffer.stop)
+        if flush:
+            _tally_buffer.stop()
+        else:
+            _tally_buffer._stop.set()
+    _tally_buffer = None
+
+
+@receiver(setting_changed)
+def _reset_tally_buffer(setting, **kwargs):
+    global _tally_buffer
+    if setting == 'POLLS_VOTE_BUFFER' and _tally_buffer is not None:
+        _tally_buffer.stop()
+        _tally_buffer = None
@@ -0,0 +1,201 @@
+"""Cache of poll pages and question lists.
+
+Entries are versioned: invalidating bumps the version, so a value computed
+from data read before the bump is stored under a key nobody asks for
+again. Versions start from the clock, so a version key lost to eviction
+never revives an old entry.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .routers import reading_from_replica
+
+INDEX = 'polls:index'
+LIFECYCLE = 'polls:lifecycle:boundary'
+
+
+def _cache():
+    return caches[getattr(settings, 'POLLS_CACHE_ALIAS', 'default')]
+
+
+def _timeout(timeout):
+    # A replica may lag behind the write that invalidated the entry, so
+    # values read from one live no longer than a voter stays pinned.
+    if reading_from_replica():
+        return min(timeout, getattr(settings, 'POLLS_REPLICA_PIN_SECONDS', 5))
+    return timeout
+
+
+def _results(question_id):
+    return f'polls:results:{question_id}'
+
+
+def version(name):
+    """Return the current cache version of name."""
+    return _cache().get_or_set(f'{name}:version', time.time_ns, timeout=None)
+
+
+async def aversion(name):
+    """Async version of version()."""
+    return await _cache().aget_or_set(f'{name}:version', time.time_ns, timeout=None)
+
+
+def invalidate(*names):
+    """Bump the version of every name, dropping their cached values."""
+    cache = _cache()
+    for name in names:
+        try:
+            cache.incr(f'{name}:version')
+        except ValueError:
+            cache.set(f'{name}:version', time.time_ns(), timeout=None)
+
+
+def _user(user_id):
+    return f'polls:user:{user_id}'
+
+
+def user_version(user_id):
+    """Return the current cache version of a user."""
+    return version(_user(user_id))
+
+
+def get_user(user_id, version):
+    """Return the cached user, or None."""
+    return _cache().get(f'{_user(user_id)}:{version}')
+
+
+def set_user(user, version):
+    """Cache a user for POLLS_AUTH_CACHE_TIMEOUT seconds."""
+    timeout = getattr(settings, 'POLLS_AUTH_CACHE_TIMEOUT', 0)
+    if timeout:
+        _cache().set(f'{_user(user.pk)}:{version}', user, timeout)
+
+
+def invalidate_user(user_id):
+    """Drop the cached copy of a user."""
+    invalidate(_user(user_id))
+
+
+def results_version(question_id):
+    """Return the current cache version of the results of a question."""
+    return version(_results(question_id))
+
+
+async def aresults_version(question_id):
+    """Async version of results_version()."""
+    return await aversion(_results(question_id))
+
+
+def get_results_page(question_id, version):
+    """Return the cached body of a results page, or None."""
+    return _cache().get(f'{_results(question_id)}:body:{version}')
+
+
+async def aget_results_page(question_id, version):
+    """Async version of get_results_page()."""
+    return await _cache().aget(f'{_results(question_id)}:body:{version}')
+
+
+def set_results_page(question_id, version, content):
+    """Store a rendered results page body."""
+    timeout = _timeout(getattr(settings, 'POLLS_RESULTS_CACHE_TIMEOUT', 300))
+    if timeout:
+        _cache().set(f'{_results(question_id)}:body:{version}', content, timeout)
+
+
+async def aset_results_page(question_id, version, content):
+    """Async version of set_results_page()."""
+    timeout = _timeout(getattr(settings, 'POLLS_RESULTS_CACHE_TIMEOUT', 300))
+    if timeout:
+        await _cache().aset(f'{_results(question_id)}:body:{version}', content, timeout)
+
+
+def invalidate_results(question_ids):
+    """Drop the cached results of the given questions."""
+    invalidate(*(_results(question_id) for question_id in question_ids))
+
+
+def analytics_key(question_ids, bucket_seconds):
+    """Return the cache key of an analytics report of the sorted
+    question_ids. It follows the results version of every question, so a
+    vote on any of them changes the key."""
+    versions = _cache().get_many([f'{_results(pk)}:version' for pk in question_ids])
+    missing = [pk for pk in question_ids if f'{_results(pk)}:version' not in versions]
+    versions.update({f'{_results(pk)}:version': results_version(pk) for pk in missing})
+    stamp = hashlib.md5(','.join(f'{pk}.{versions[f"{_results(pk)}:version"]}'
+                                 for pk in question_ids).encode()).hexdigest()
+    return f'polls:analytics:{bucket_seconds}:{stamp}'
+
+
+def get_analytics(key):
+    """Return the cached analytics report under key, or None."""
+    return _cache().get(key)
+
+
+def set_analytics(key, report):
+    """Store an analytics report computed after its key was taken."""
+    timeout = getattr(settings, 'POLLS_ANALYTICS_CACHE_TIMEOUT', 300)
+    if timeout:
+        _cache().set(key, report, timeout)
+
+
+def get_index(version):
+    """Return the cached index question list, or None."""
+    return _cache().get(f'{INDEX}:{version}')
+
+
+async def aget_index(version):
+    """Async version of get_index()."""
+    return await _cache().aget(f'{INDEX}:{version}')
+
+
+def set_index(version, questions, timeout):
+    """Store the index question list for at most timeout seconds."""
+    timeout = _timeout(min(timeout, getattr(settings, 'POLLS_INDEX_CACHE_TIMEOUT', 300)))
+    if timeout > 0:
+        _cache().set(f'{INDEX}:{version}', questions, timeout)
+
+
+async def aset_index(version, questions, timeout):
+    """Async version of set_index()."""
+    timeout = _timeout(min(timeout, getattr(settings, 'POLLS_INDEX_CACHE_TIMEOUT', 300)))
+    if timeout > 0:
+        await _cache().aset(f'{INDEX}:{version}', questions, timeout)
+
+
+def invalidate_index():
+    """Drop the cached index question list."""
+    invalidate(INDEX)
+
+
+def lifecycle_due(now):
+    """Return whether a question state may have changed since the last
+    boundary was remembered."""
+    boundary = _cache().get(LIFECYCLE)
+    if boundary is None:
+        return True
+    return bool(boundary) and boundary <= now
+
+
+async def alifecycle_due(now):
+    """Async version of lifecycle_due()."""
+    boundary = await _cache().aget(LIFECYCLE)
+    if boundary is None:
+        return True
+    return bool(boundary) and boundary <= now
+
+
+def set_lifecycle_boundary(boundary):
+    """Remember the next question state transition, or False for none.
+    It is rechecked after POLLS_LIFECYCLE_RECHECK_SECONDS, since questions
+    saved by other processes may move it earlier."""
+    _cache().set(LIFECYCLE, boundary or False,
+                 getattr(settings, 'POLLS_LIFECYCLE_RECHECK_SECONDS', 60))
+
+
+def invalidate_lifecycle():
+    """Forget the next question state transition."""
+    _cache().delete(LIFECYCLE)
@@ -0,0 +1,56 @@
+"""Conditional GETs of the index and results pages.
+
+Results pages are versioned by the results cache version of their
+question, which every committed vote, tally flush, choice edit and state
+change bumps; votes never write to the question row for it. Index pages
+are versioned by the modified_at stamps of the questions they list and by
+the user greeted on them. Clients and shared caches revalidate with
+If-None-Match and get a 304 without a page being rendered.
+"""
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def results_etag(question_id, version, primary=False):
+    """Return the ETag of the results page of a question at a results
+    cache version. Pages read from the primary by clients pinned to it get
+    their own ETag, so a page rendered from a lagging replica at the same
+    version never revalidates theirs."""
+    return quote_etag(f'results-{question_id}-{version}{"-primary" if primary else ""}')
+
+
+def index_etag(questions, user):
+    """Return the ETag of the index page listing questions to user."""
+    stamp = hashlib.md5(','.join(
+        [str(user.pk or 0)] + [f'{question.pk}.{question.modified_at.timestamp():.6f}'
+                               for question in questions]).encode()).hexdigest()
+    return quote_etag(f'index-{stamp}')
+
+
+def add_validators(response, etag, modified_at=None, private=False):
+    """Set the ETag, Last-Modified and Cache-Control headers of response.
+    Shared caches may keep public pages for POLLS_SHARED_CACHE_MAX_AGE
+    seconds; browsers revalidate every time."""
+    response['ETag'] = etag
+    if modified_at is not None:
+        response['Last-Modified'] = http_date(modified_at.timestamp())
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True,
+                            s_maxage=settings.POLLS_SHARED_CACHE_MAX_AGE)
+    return response
+
+
+def not_modified(request, etag, modified_at=None, private=False):
+    """Return a 304 response if the client holds the current version of
+    the page, or else None."""
+    response = get_conditional_response(
+        request, etag=etag,
+        last_modified=int(modified_at.timestamp()) if modified_at is not None else None)
+    if response is None:
+        return None
+    return add_validators(response, etag, modified_at, private)
@@ -0,0 +1,139 @@
+"""Live tallies of questions for Server-Sent Events watchers.
+
+Committed votes mark their question dirty through publish(). Every
+question with watchers has one pump task on the event loop. At most once
+per POLLS_SSE_TICK seconds it reads the tallies of a dirty question and
+hands the same message to every watcher. A thousand watchers of a poll
+therefore cost one tally query per tick, not one each.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import weakref
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+from .routers import replica_reads
+
+logger = logging.getLogger(__name__)
+
+
+def _tick():
+    return getattr(settings, 'POLLS_SSE_TICK', 1.0)
+
+
+def live(request):
+    """Return whether request may watch live results: POLLS_LIVE_RESULTS is
+    on and it came in over ASGI. A WSGI server reads a streaming response
+    to its end before sending it, holding a worker for the whole stream."""
+    return getattr(settings, 'POLLS_LIVE_RESULTS', False) and isinstance(request, ASGIRequest)
+
+
+async def snapshot(question_id):
+    """Return the JSON tallies message of a question."""
+    from .models import Choice
+    with replica_reads():
+        tallies = [{'id': choice.pk, 'choice_text': choice.choice_text, 'votes': choice.votes()}
+                   async for choice in Choice.objects.filter(question_id=question_id).order_by('pk')]
+    return json.dumps({'question': question_id, 'choices': tallies})
+
+
+class _Channel:
+    """Watchers of one question on one event loop."""
+
+    def __init__(self):
+        self.watchers = set()
+        self.dirty = False
+        self.message = None
+        self.pump = None
+
+
+class TallyBroadcaster:
+    """Fans tally messages of questions out to watcher queues."""
+
+    def __init__(self):
+        self.channels = {}
+
+    def publish(self, question_ids):
+        """Mark questions as changed. Safe to call from any thread."""
+        for question_id in question_ids:
+            channel = self.channels.get(question_id)
+            if channel is not None:
+                channel.dirty = True
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, question_id):
+        """Yield a queue receiving the tally messages of a question. The
+        current message is queued first."""
+        channel = self.channels.setdefault(question_id, _Channel())
+        queue = asyncio.Queue(maxsize=1)
+        channel.watchers.add(queue)
+        try:
+            if channel.message is None or channel.dirty:
+                channel.dirty = False
+                channel.message = await snapshot(question_id)
+            queue.put_nowait(channel.message)
+            if channel.pump is None:
+                channel.pump = asyncio.ensure_future(self._pump(question_id, channel))
+            yield queue
+        finally:
+            channel.watchers.discard(queue)
+            if not channel.watchers:
+                if channel.pump is not None:
+                    channel.pump.cancel()
+                if self.channels.get(question_id) is channel:
+                    del self.channels[question_id]
+
+    async def _pump(self, question_id, channel):
+        while True:
+            await asyncio.sleep(_tick())
+            if not channel.dirty:
+                continue
+            channel.dirty = False
+            try:
+                channel.message = await snapshot(question_id)
+            except Exception:
+                logger.exception('Could not read the tallies of question %s.', question_id)
+                channel.dirty = True
+                continue
+            for queue in channel.watchers:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(channel.message)
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    """Return the broadcaster of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters[loop] = TallyBroadcaster()
+    return _broadcasters[loop]
+
+
+def publish(question_ids):
+    """Mark questions as changed on every event loop with watchers."""
+    for broadcaster in list(_broadcasters.values()):
+        broadcaster.publish(question_ids)
+
+
+async def stream(question_id):
+    """Yield the tallies of a question as Server-Sent Events until
+    POLLS_SSE_MAX_SECONDS pass; browsers then reconnect on their own."""
+    keepalive = getattr(settings, 'POLLS_SSE_KEEPALIVE', 15)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'POLLS_SSE_MAX_SECONDS', 300)
+    async with get_broadcaster().subscribe(question_id) as queue:
+        yield f'retry: {int(_tick() * 1000)}\n\n'
+        while loop.time() < deadline:
+            timeout = min(keepalive, deadline - loop.time())
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+            else:
+                yield f'event: tallies\ndata: {message}\n\n'
@@ -0,0 +1,251 @@
+"""Per-view query and latency instrumentation.
+
+InstrumentationMiddleware samples requests at
+POLLS_INSTRUMENTATION_SAMPLE_RATE. For each sampled request it records
+the query count, SQL time, template render time and wall time of the view
+into process-wide histograms. It also records the fingerprints of queries
+run more than once in the same request, which is how N+1 loops show up.
+Render time comes from the InstrumentedDjangoTemplates backend.
+"""
+import bisect
+import contextlib
+import contextvars
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+# Upper bounds of the histogram buckets, Prometheus style.
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_current = contextvars.ContextVar('polls_instrumentation_probe', default=None)
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Return sql with IN lists and whitespace collapsed."""
+    return _SPACE.sub(' ', _IN_LIST.sub('(...)', sql)).strip()
+
+
+class Histogram:
+    """Cumulative bucket counts with a sum, as Prometheus exposes them."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, count) pairs ending with +Inf."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                            for bound, count in self.cumulative()}}
+
+
+class _Probe:
+    """Measurements of one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+class MetricsRegistry:
+    """Histograms and duplicate query counts per view."""
+
+    METRICS = {
+        'wall_seconds': SECONDS_BUCKETS,
+        'sql_seconds': SECONDS_BUCKETS,
+        'render_seconds': SECONDS_BUCKETS,
+        'queries': QUERY_BUCKETS,
+    }
+
+    def __init__(self, top_duplicates=10):
+        self.top_duplicates = top_duplicates
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, wall_seconds, probe):
+        duplicates = {sql: count for sql, count in probe.fingerprints.items() if count > 1}
+        with self.lock:
+            entry = self.views.get(view)
+            if entry is None:
+                entry = self.views[view] = {
+                    'histograms': {name: Histogram(buckets)
+                                   for name, buckets in self.METRICS.items()},
+                    'duplicates': Counter(),
+                }
+            histograms = entry['histograms']
+            histograms['wall_seconds'].observe(wall_seconds)
+            histograms['sql_seconds'].observe(probe.sql_seconds)
+            histograms['render_seconds'].observe(probe.render_seconds)
+            histograms['queries'].observe(probe.queries)
+            entry['duplicates'].update(duplicates)
+
+    def snapshot(self):
+        """Return the metrics of every view as plain data."""
+        with self.lock:
+            return {view: {
+                'histograms': {name: histogram.as_dict()
+                               for name, histogram in entry['histograms'].items()},
+                'duplicate_queries': [{'sql': sql, 'count': count} for sql, count
+                                      in entry['duplicates'].most_common(self.top_duplicates)],
+            } for view, entry in sorted(self.views.items())}
+
+    def prometheus(self):
+        """Return the histograms in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            for name in self.METRICS:
+                metric = f'polls_view_{name}'
+                lines.append(f'# HELP {metric} Per-request {name.replace("_", " ")} by view.')
+                lines.append(f'# TYPE {metric} histogram')
+                for view, entry in sorted(self.views.items()):
+                    histogram = entry['histograms'][name]
+                    label = view.replace('\\', '\\\\').replace('"', '\\"')
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f'{metric}_bucket{{view="{label}",le="{le}"}} {count}')
+                    lines.append(f'{metric}_sum{{view="{label}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{label}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _sampled():
+    rate = getattr(settings, 'POLLS_INSTRUMENTATION_SAMPLE_RATE', 0.0)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _wrap_connections(probe):
+    """Return an ExitStack holding probe on every connection of this thread."""
+    stack = contextlib.ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(probe))
+    return stack
+
+
+def _record(request, started, probe):
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name or match._func_path) if match else 'unresolved'
+    registry.record(view, time.perf_counter() - started, probe)
+
+
+class InstrumentationMiddleware:
+    """Record query and timing metrics of a sample of requests.
+
+    It runs in either mode, so under ASGI it does not push the middleware
+    chain, and with it the async views, onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _sampled():
+            return self.get_response(request)
+        probe = _Probe()
+        token = _current.set(probe)
+        started = time.perf_counter()
+        try:
+            with _wrap_connections(probe):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, started, probe)
+        return response
+
+    async def __acall__(self, request):
+        if not _sampled():
+            return await self.get_response(request)
+        probe = _Probe()
+        token = _current.set(probe)
+        started = time.perf_counter()
+        try:
+            # The async ORM runs queries on the thread sensitive sync thread
+            # of the request, so the wrappers go on its connections.
+            stack = await sync_to_async(_wrap_connections)(probe)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _current.reset(token)
+        _record(request, started, probe)
+        return response
+
+
+class _TimedTemplate:
+    """Adds the render time of a template to the current probe."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        probe = _current.get()
+        if probe is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            probe.render_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend reporting render time to the middleware."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = ('Move questions whose pub_date or end_date has passed to their '
+            'current state. Views also do this on demand; run it from cron, '
+            'or with --loop as a scheduler process, to keep states current '
+            'between requests.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, waking at each transition.')
+        parser.add_argument('--max-sleep', type=float, default=60.0,
+                            help='Longest wait between checks with --loop, in seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            moved = Question.advance()
+            if moved or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Advanced {len(moved)} question(s).'))
+            if not options['loop']:
+                return
+            now = timezone.now()
+            boundary = Question.next_boundary(now)
+            wait = options['max_sleep']
+            if boundary is not None:
+                wait = min(wait, max(0.0, (boundary - now).total_seconds()))
+            close_old_connections()
+            time.sleep(wait)
@@ -0,0 +1,108 @@
+import json
+import platform
+import subprocess
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from polls import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database with synthetic polls and report '
+            'latency, throughput and queries per request for each endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1000)
+        parser.add_argument('--choices', type=int, default=4,
+                            help='Choices per question.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--votes', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--endpoints', nargs='+', choices=benchmark.ENDPOINTS,
+                            default=list(benchmark.ENDPOINTS))
+        parser.add_argument('--asgi', action='store_true',
+                            help='Send requests through the ASGI handler from '
+                                 'concurrent coroutines instead of WSGI threads.')
+        parser.add_argument('--sessions', choices=settings.SESSION_ENGINES,
+                            help='Session store of the logged-in requests, '
+                                 'instead of SESSION_BACKEND.')
+        parser.add_argument('--cold-starts', type=int, default=0,
+                            help='Also time the first request of this many fresh '
+                                 'server processes, with and without template warm-up.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep and reuse the benchmark database.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            # The shared in-memory test database locks whole tables, so
+            # concurrent workers need a database file.
+            connection.settings_dict['TEST']['NAME'] = str(settings.BASE_DIR / 'benchmark.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            if not (options['keepdb'] and benchmark.Question.objects.exists()):
+                scale = benchmark.seed(options['questions'], options['choices'],
+                                       options['users'], options['votes'],
+                                       options['batch_size'])
+            else:
+                scale = {'reused': True}
+            for cache in caches.all():
+                cache.clear()
+            session_engine = settings.SESSION_ENGINES.get(options['sessions'])
+            report = benchmark.run(options['endpoints'], options['requests'],
+                                   options['concurrency'], asgi=options['asgi'],
+                                   session_engine=session_engine)
+            if options['cold_starts']:
+                database = {'DB_NAME': connection.settings_dict['NAME']}
+                report['cold_start'] = {
+                    name: benchmark.cold_start(runs=options['cold_starts'],
+                                               env={**database, 'TEMPLATE_WARMUP': warmup})
+                    for name, warmup in (('without_warmup', 'False'), ('with_warmup', 'True'))
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0,
+                                                keepdb=options['keepdb'])
+            teardown_test_environment()
+        report['meta'] = {
+            'commit': self.commit(),
+            'python': platform.python_version(),
+            'database': self.database_profile(),
+            'concurrency': options['concurrency'],
+            'handler': 'asgi' if options['asgi'] else 'wsgi',
+            'async_views': settings.POLLS_ASYNC_VIEWS,
+            'session_engine': session_engine or settings.SESSION_ENGINE,
+            'auth_cache_timeout': settings.POLLS_AUTH_CACHE_TIMEOUT,
+            'scale': scale,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+        self.stdout.write(text)
+
+    def database_profile(self):
+        """Return the settings that shape database throughput."""
+        database = settings.DATABASES['default']
+        profile = {'engine': database['ENGINE'],
+                   'conn_max_age': database.get('CONN_MAX_AGE', 0),
+                   'options': database.get('OPTIONS', {})}
+        if connection.vendor == 'sqlite':
+            profile['pragmas'] = settings.SQLITE_PRAGMAS
+        return profile
+
+    def commit(self):
+        """Return the current git commit, if any."""
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                  text=True, cwd=settings.BASE_DIR).stdout.strip() or None
+        except OSError:
+            return None
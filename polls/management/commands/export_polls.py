@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import transfer
+
+
+class Command(BaseCommand):
+    help = ('Stream users, questions, choices and votes to JSON Lines, or one '
+            'model to CSV, reading the database with server-side cursors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--model', action='append', dest='models',
+                            help='Model to export, may repeat. Defaults to all for '
+                                 'JSON Lines; CSV takes exactly one.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows fetched per cursor round trip.')
+        parser.add_argument('-o', '--output', help='Output file, standard output by default.')
+
+    def handle(self, *args, **options):
+        try:
+            labels = [transfer.model_label(name) for name in options['models'] or transfer.MODELS]
+        except ValueError as error:
+            raise CommandError(error)
+        if options['format'] == 'csv' and len(labels) != 1:
+            raise CommandError('CSV export takes exactly one --model.')
+        stream = open(options['output'], 'w', newline='', encoding='utf-8') \
+            if options['output'] else self.stdout
+        try:
+            if options['format'] == 'csv':
+                written = transfer.write_csv(stream, labels[0], options['batch_size'])
+            else:
+                written = transfer.write_jsonl(stream, labels, options['batch_size'])
+        finally:
+            if options['output']:
+                stream.close()
+        if options['output']:
+            self.stdout.write(f'Exported {written} rows to {options["output"]}.')
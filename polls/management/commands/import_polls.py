@@ -0,0 +1,57 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import transfer
+
+
+class Command(BaseCommand):
+    help = ('Stream users, questions, choices and votes from JSON Lines or CSV '
+            'files into the database in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+',
+                            help="Files to import, '-' reads standard input.")
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--model',
+                            help='Model of the rows of CSV files, e.g. question.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per bulk insert and transaction.')
+        parser.add_argument('--ignore-conflicts', action='store_true',
+                            help='Skip rows whose primary key or vote already exists.')
+        parser.add_argument('--no-rebuild', action='store_true',
+                            help='Do not recount choice tallies afterwards.')
+
+    def handle(self, *args, **options):
+        label = None
+        if options['format'] == 'csv':
+            if not options['model']:
+                raise CommandError('--model is required for CSV files.')
+            try:
+                label = transfer.model_label(options['model'])
+            except ValueError as error:
+                raise CommandError(error)
+        importer = transfer.Importer(options['batch_size'], options['ignore_conflicts'])
+        for name in options['files']:
+            stream = sys.stdin if name == '-' else open(name, newline='', encoding='utf-8')
+            try:
+                if label:
+                    records = transfer.read_csv(stream, label)
+                else:
+                    records = transfer.read_jsonl(stream)
+                for record_label, pk, values, line in records:
+                    importer.add(record_label, pk, values, f'{name} line {line}')
+            except transfer.InvalidRecord as error:
+                raise CommandError(error)
+            except ValueError as error:
+                raise CommandError(f'{name}: {error}')
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+        try:
+            counts = importer.finish(rebuild_tallies=not options['no_rebuild'])
+        except transfer.InvalidRecord as error:
+            raise CommandError(error)
+        for model, count in counts.items():
+            if count:
+                self.stdout.write(f'Imported {count} {model} rows.')
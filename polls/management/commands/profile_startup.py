@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from polls import startup
+
+
+class Command(BaseCommand):
+    help = ('Import the WSGI and ASGI entry points in fresh interpreters with '
+            '-X importtime and report the total import time and the slowest '
+            'modules of each.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', default=['mysite.wsgi', 'mysite.asgi'],
+                            help='Modules to profile.')
+        parser.add_argument('--settings-module', dest='settings_module',
+                            help='DJANGO_SETTINGS_MODULE of the profiled imports, such '
+                                 'as mysite.settings_public.')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Modules listed per entry point.')
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+        parser.add_argument('--json', action='store_true', help='Print a JSON report.')
+
+    def handle(self, *args, **options):
+        report = {}
+        for module in options['modules']:
+            imports = startup.profile_imports(module, options['settings_module'])
+            slowest = sorted(imports, key=lambda item: item[f"{options['sort']}_ms"],
+                             reverse=True)[:options['top']]
+            report[module] = {
+                'total_ms': sum(item['self_ms'] for item in imports),
+                'modules': len(imports),
+                'slowest': slowest,
+            }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for module, profile in report.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{module}: {profile['total_ms']:.1f} ms importing {profile['modules']} modules"))
+            self.stdout.write(f"{'self ms':>9} {'total ms':>9}  module")
+            for item in profile['slowest']:
+                self.stdout.write(f"{item['self_ms']:9.1f} {item['cumulative_ms']:9.1f}  "
+                                  f"{item['module']}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from polls import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text search index of questions and choices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to rebuild the index of.')
+
+    def handle(self, *args, **options):
+        search.rebuild_index(options['database'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt the search index.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Choice
+
+
+class Command(BaseCommand):
+    help = 'Recount the stored vote tally of every choice from the Vote table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help='Only rebuild the choices of these questions.')
+
+    def handle(self, *args, **options):
+        choices = Choice.objects.all()
+        if options['question_ids']:
+            choices = choices.filter(question_id__in=options['question_ids'])
+        updated = Choice.rebuild_tallies(choices)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt tallies of {updated} choices.'))
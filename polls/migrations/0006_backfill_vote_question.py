@@ -0,0 +1,27 @@
+from django.db import migrations
+from django.db.models import Exists, OuterRef, Subquery
+
+
+def backfill_vote_question(apps, schema_editor):
+    """Copy choice.question onto every vote and keep only the latest vote
+    of each user per question, so the unique constraint can be added."""
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    Vote.objects.update(question_id=Subquery(
+        Choice.objects.filter(pk=OuterRef('choice_id')).values('question_id')[:1]
+    ))
+    newer = Vote.objects.filter(user_id=OuterRef('user_id'),
+                                question_id=OuterRef('question_id'),
+                                pk__gt=OuterRef('pk'))
+    Vote.objects.filter(Exists(newer)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_vote_question'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_vote_question, migrations.RunPython.noop),
+    ]
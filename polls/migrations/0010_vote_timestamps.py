@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_question_pub_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='changes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        # Added without a default first, so existing votes keep an unknown
+        # time instead of the time of the migration.
+        migrations.AddField(
+            model_name='vote',
+            name='voted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='voted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:42
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def store_states(apps, schema_editor):
+    """Fill state and next_transition from the dates of every question."""
+    Question = apps.get_model('polls', 'Question')
+    now = timezone.now()
+    questions = Question.objects
+    questions.filter(pub_date__gt=now).update(state='scheduled', next_transition=F('pub_date'))
+    published = questions.filter(pub_date__lte=now)
+    published.filter(end_date__lt=now).update(state='closed', next_transition=None)
+    published.filter(end_date__isnull=True).update(state='open', next_transition=None)
+    published.filter(end_date__gte=now).update(state='open', next_transition=F('end_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_vote_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='next_transition',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='state',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('open', 'Open'), ('closed', 'Closed')], db_index=True, default='scheduled', editable=False, max_length=9),
+        ),
+        migrations.RunPython(store_states, migrations.RunPython.noop),
+    ]
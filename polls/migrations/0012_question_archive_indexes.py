@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_question_state'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['pub_date', 'id'], name='polls_question_pub_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['state', 'pub_date', 'id'], name='polls_question_state_pub_date'),
+        ),
+    ]
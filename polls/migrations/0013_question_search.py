@@ -0,0 +1,82 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:46
+
+from django.db import migrations
+
+# Question texts are indexed under rowid 2 * id and choice texts under
+# 2 * id + 1, so both live in one table and every row knows its question.
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE polls_search USING fts5(
+        body, kind UNINDEXED, question_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""",
+    """INSERT INTO polls_search (rowid, body, kind, question_id)
+        SELECT id * 2, question_text, 'question', id FROM polls_question""",
+    """INSERT INTO polls_search (rowid, body, kind, question_id)
+        SELECT id * 2 + 1, choice_text, 'choice', question_id FROM polls_choice""",
+    """CREATE TRIGGER polls_search_question_insert AFTER INSERT ON polls_question BEGIN
+        INSERT INTO polls_search (rowid, body, kind, question_id)
+        VALUES (new.id * 2, new.question_text, 'question', new.id);
+    END""",
+    """CREATE TRIGGER polls_search_question_update AFTER UPDATE OF question_text ON polls_question
+    BEGIN
+        UPDATE polls_search SET body = new.question_text WHERE rowid = new.id * 2;
+    END""",
+    """CREATE TRIGGER polls_search_question_delete AFTER DELETE ON polls_question BEGIN
+        DELETE FROM polls_search WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER polls_search_choice_insert AFTER INSERT ON polls_choice BEGIN
+        INSERT INTO polls_search (rowid, body, kind, question_id)
+        VALUES (new.id * 2 + 1, new.choice_text, 'choice', new.question_id);
+    END""",
+    """CREATE TRIGGER polls_search_choice_update
+    AFTER UPDATE OF choice_text, question_id ON polls_choice BEGIN
+        UPDATE polls_search SET body = new.choice_text, question_id = new.question_id
+        WHERE rowid = new.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER polls_search_choice_delete AFTER DELETE ON polls_choice BEGIN
+        DELETE FROM polls_search WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+SQLITE_BACKWARD = [
+    f'DROP TRIGGER IF EXISTS polls_search_{model}_{event}'
+    for model in ('question', 'choice') for event in ('insert', 'update', 'delete')
+] + ['DROP TABLE IF EXISTS polls_search']
+
+# The expressions match the SearchVector(..., config='simple') that
+# polls.search builds, so the planner can use these indexes.
+POSTGRESQL_FORWARD = [
+    """CREATE INDEX polls_question_search ON polls_question
+        USING gin (to_tsvector('simple'::regconfig, COALESCE(question_text, '')))""",
+    """CREATE INDEX polls_choice_search ON polls_choice
+        USING gin (to_tsvector('simple'::regconfig, COALESCE(choice_text, '')))""",
+]
+
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS polls_question_search',
+    'DROP INDEX IF EXISTS polls_choice_search',
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    """Build the full-text index of the backend, if it has one."""
+    _run(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD})
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_question_archive_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
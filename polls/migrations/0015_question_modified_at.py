@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0014_vote_voted_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,26 +1,55 @@
 import datetime
-from django.db import models
+from collections import Counter
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from django.contrib import admin
 from django.contrib.auth.models import User
 
+from . import cache
+from .buffer import get_tally_buffer
+from .signals import tallies_changed
+
 
 class Question(models.Model):
     """Question model for creating questions."""
+
+    class State(models.TextChoices):
+        SCHEDULED = 'scheduled', 'Scheduled'
+        OPEN = 'open', 'Open'
+        CLOSED = 'closed', 'Closed'
+
     question_text = models.CharField(max_length=200)
-    pub_date = models.DateTimeField('date published')
+    pub_date = models.DateTimeField('date published', db_index=True)
     end_date = models.DateTimeField('date expired', null=True, default=None, blank=True)
+    # Stored from the dates on save and moved on by advance().
+    state = models.CharField(max_length=9, choices=State.choices, default=State.SCHEDULED,
+                             db_index=True, editable=False)
+    next_transition = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+    # Moved on by every change to the question row, so it versions the
+    # index page for conditional requests. Votes leave it alone.
+    modified_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the archive, unfiltered and by state.
+            models.Index(fields=['pub_date', 'id'], name='polls_question_pub_date_id'),
+            models.Index(fields=['state', 'pub_date', 'id'],
+                         name='polls_question_state_pub_date'),
+        ]
 
-    @admin.display(
-        boolean=True,
-        ordering='pub_date',
-        description='Published recently?',
-    )
     def was_published_recently(self):
         """Return boolean for it was published recently or not."""
         now = timezone.localtime()
         return now - datetime.timedelta(days=1) <= self.pub_date <= now
 
+    # Admin column options, set directly rather than with admin.display so
+    # the models load without the admin on public nodes.
+    was_published_recently.boolean = True
+    was_published_recently.admin_order_field = 'pub_date'
+    was_published_recently.short_description = 'Published recently?'
+
     def is_published(self):
         """Return boolean for the question was published or not."""
         now = timezone.localtime()
@@ -32,6 +61,84 @@ class Question(models.Model):
             return self.is_published()
         return self.pub_date <= timezone.localtime() <= self.end_date
 
+    def lifecycle(self, now=None):
+        """Return the state of the question at now and when it changes next."""
+        now = now or timezone.now()
+        if self.pub_date > now:
+            return self.State.SCHEDULED, self.pub_date
+        if self.end_date is None:
+            return self.State.OPEN, None
+        if now <= self.end_date:
+            return self.State.OPEN, self.end_date
+        return self.State.CLOSED, None
+
+    def save(self, *args, **kwargs):
+        """Store the state matching the dates and the time of the change."""
+        self.state, self.next_transition = self.lifecycle()
+        self.modified_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'state', 'next_transition', 'modified_at'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def sync_states(cls, queryset=None, now=None):
+        """Store the state at now of the given questions (all by default)
+        with one UPDATE per state."""
+        now = now or timezone.now()
+        if queryset is None:
+            queryset = cls.objects.all()
+        queryset.filter(pub_date__gt=now).update(
+            state=cls.State.SCHEDULED, next_transition=F('pub_date'), modified_at=now)
+        published = queryset.filter(pub_date__lte=now)
+        published.filter(end_date__lt=now).update(
+            state=cls.State.CLOSED, next_transition=None, modified_at=now)
+        published.filter(end_date__isnull=True).update(
+            state=cls.State.OPEN, next_transition=None, modified_at=now)
+        published.filter(end_date__gte=now).update(
+            state=cls.State.OPEN, next_transition=F('end_date'), modified_at=now)
+
+    @classmethod
+    def advance(cls, now=None):
+        """Move every question whose next transition is due to its current
+        state, drop the caches showing them and remember the next boundary.
+        Return the ids of the questions moved."""
+        now = now or timezone.now()
+        questions = cls.objects.db_manager(router.db_for_write(cls))
+        with transaction.atomic(using=questions.db):
+            due = list(questions.select_for_update()
+                       .filter(next_transition__lte=now).values_list('pk', flat=True))
+            if due:
+                cls.sync_states(questions.filter(pk__in=due), now)
+            boundary = questions.filter(next_transition__gt=now) \
+                .aggregate(boundary=models.Min('next_transition'))['boundary']
+        if due:
+            cache.invalidate_index()
+            cache.invalidate_results(due)
+        cache.set_lifecycle_boundary(boundary)
+        return due
+
+    @classmethod
+    def catch_up(cls, now=None):
+        """Advance the stored states if a transition came due since the
+        last check. Costs one cache read otherwise."""
+        now = now or timezone.now()
+        if cache.lifecycle_due(now):
+            cls.advance(now)
+
+    @classmethod
+    async def acatch_up(cls, now=None):
+        """Async version of catch_up()."""
+        now = now or timezone.now()
+        if await cache.alifecycle_due(now):
+            await sync_to_async(cls.advance)(now)
+
+    @classmethod
+    def next_boundary(cls, now):
+        """Return the first stored state transition after now, or None."""
+        return cls.objects.filter(next_transition__gt=now) \
+            .aggregate(boundary=models.Min('next_transition'))['boundary']
+
     def __str__(self):
         """Return Question string."""
         return self.question_text
@@ -41,22 +148,219 @@ class Choice(models.Model):
     """Choice model for creating choices."""
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
 
     def votes(self):
-        """Count vote from choice"""
-        return Vote.objects.filter(choice=self).count()
+        """Return the maintained vote count of this choice, including
+        changes still waiting in the write-behind buffer."""
+        tally_buffer = get_tally_buffer()
+        if tally_buffer is None:
+            return self.vote_count
+        return self.vote_count + tally_buffer.pending(self.pk)
+
+    @classmethod
+    def record_tallies(cls, deltas):
+        """Apply tally deltas now, or hand them to the write-behind buffer
+        once the current transaction commits."""
+        tally_buffer = get_tally_buffer()
+        if tally_buffer is None:
+            cls.adjust_tallies(deltas)
+        else:
+            transaction.on_commit(lambda: tally_buffer.add(deltas))
+
+    @classmethod
+    def adjust_tallies(cls, deltas):
+        """Apply a {choice_id: delta} mapping to vote_count in one UPDATE."""
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        cls.objects.filter(pk__in=deltas).update(vote_count=F('vote_count') + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            default=Value(0),
+        ))
+
+    @classmethod
+    def rebuild_tallies(cls, queryset=None):
+        """Recount vote_count from the Vote table for the given choices
+        (all choices by default). Return the number of choices updated."""
+        if queryset is None:
+            queryset = cls.objects.all()
+        counts = Vote.objects.filter(choice=OuterRef('pk')).order_by() \
+            .values('choice').annotate(total=Count('pk')).values('total')
+        updated = queryset.update(vote_count=Coalesce(Subquery(counts), 0))
+        cache.invalidate_results(set(queryset.values_list('question_id', flat=True)))
+        return updated
 
     def __str__(self):
         """Return Choice string."""
         return self.choice_text
 
 
+class VoteQuerySet(models.QuerySet):
+    """Votes whose delete() takes them off their choice tallies in bulk."""
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            Vote.release_tallies(self)
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Vote(models.Model):
     """Vote model for check authenticated user vote"""
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    # Unknown (null) for votes cast before they were recorded.
+    voted_at = models.DateTimeField(default=timezone.now, null=True, editable=False,
+                                    db_index=True)
+    changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    changes = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = VoteQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'],
+                                    name='unique_vote_per_question'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'choice'],
+                         name='polls_vote_question_choice'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Keep the denormalized question in step with the choice."""
+        self.question_id = self.choice.question_id
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Delete the vote and take it off its choice tally."""
+        using = kwargs.get('using') or router.db_for_write(Vote, instance=self)
+        with transaction.atomic(using=using):
+            Vote.release_tallies(Vote.objects.using(using).filter(pk=self.pk))
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def release_tallies(cls, votes):
+        """Take the votes of a queryset about to be deleted, in the current
+        transaction, off their choice tallies with one UPDATE.
+
+        Votes have no delete signal receivers, so deleting a question or a
+        choice removes its votes in one query; their tallies go with the
+        choices. Other deletes go through here instead: the Vote queryset
+        and instance delete(), and the cascade from a deleted user.
+        """
+        deltas = Counter()
+        question_ids = set()
+        for choice_id, question_id in votes.order_by().select_for_update() \
+                .values_list('choice_id', 'question_id'):
+            deltas[choice_id] -= 1
+            question_ids.add(question_id)
+        if deltas:
+            Choice.record_tallies(deltas)
+            cls._announce(question_ids)
+
+    @classmethod
+    def cast(cls, user, choice):
+        """Record the vote of user for choice, replacing any earlier vote
+        on the same question, and keep the choice tallies in step.
+        Return the vote and whether it was created."""
+        vote = cls.objects.filter(user=user, question_id=choice.question_id).first()
+        if vote is not None and vote.choice_id == choice.pk:
+            # Resubmitting the stored choice changes nothing, so it takes
+            # no write transaction.
+            return vote, False
+        with transaction.atomic():
+            if vote is not None:
+                vote = cls.objects.select_for_update().filter(
+                    user=user, question_id=choice.question_id).first()
+            if vote is None:
+                try:
+                    with transaction.atomic():
+                        vote = cls.objects.create(user=user, choice=choice)
+                except IntegrityError:
+                    # A concurrent request inserted the vote first.
+                    vote = cls.objects.select_for_update().get(
+                        user=user, question_id=choice.question_id)
+                else:
+                    Choice.record_tallies({choice.pk: 1})
+                    cls._announce({choice.question_id})
+                    return vote, True
+            previous = vote.choice_id
+            if previous != choice.pk:
+                vote.choice = choice
+                vote.changed_at = timezone.now()
+                vote.changes += 1
+                vote.save(update_fields=['choice', 'changed_at', 'changes'])
+                Choice.record_tallies({previous: -1, choice.pk: 1})
+                cls._announce({choice.question_id})
+            return vote, False
+
+    @classmethod
+    def cast_many(cls, ballots, batch_size=1000, open_only=False):
+        """Record many votes at once from a {(user_id, question_id): choice_id}
+        mapping whose choices are known to belong to their questions.
+        Existing votes are replaced and the tallies kept in step, all in one
+        transaction. With open_only, ballots on questions whose voting window
+        is not open once the transaction has locked them are left out.
+        Return {(user_id, question_id): status} with status 'created',
+        'replaced', 'unchanged' or 'closed'."""
+        if not ballots:
+            return {}
+        statuses = {}
+        created, replaced = [], []
+        deltas = Counter()
+        now = timezone.now()
+        with transaction.atomic():
+            if open_only:
+                ballots = cls._open_ballots(ballots, statuses, now)
+            existing = {(user_id, question_id): (pk, choice_id, changes)
+                        for pk, user_id, question_id, choice_id, changes in
+                        cls.objects.select_for_update().filter(
+                            user_id__in={user_id for user_id, _ in ballots},
+                            question_id__in={question_id for _, question_id in ballots},
+                        ).values_list('pk', 'user_id', 'question_id', 'choice_id', 'changes')}
+            for (user_id, question_id), choice_id in ballots.items():
+                pk, previous, changes = existing.get((user_id, question_id), (None, None, 0))
+                if pk is None:
+                    created.append(cls(user_id=user_id, question_id=question_id,
+                                       choice_id=choice_id, voted_at=now))
+                    statuses[user_id, question_id] = 'created'
+                elif previous != choice_id:
+                    replaced.append(cls(pk=pk, choice_id=choice_id, changed_at=now,
+                                        changes=changes + 1))
+                    deltas[previous] -= 1
+                    statuses[user_id, question_id] = 'replaced'
+                else:
+                    statuses[user_id, question_id] = 'unchanged'
+                    continue
+                deltas[choice_id] += 1
+            cls.objects.bulk_create(created, batch_size=batch_size)
+            cls.objects.bulk_update(replaced, ['choice', 'changed_at', 'changes'],
+                                    batch_size=batch_size)
+            Choice.record_tallies(deltas)
+            changed = {question_id for (_, question_id), status in statuses.items()
+                       if status in ('created', 'replaced')}
+            if changed:
+                cls._announce(changed)
+        return statuses
+
+    @classmethod
+    def _open_ballots(cls, ballots, statuses, now):
+        # Locks the questions, so their dates cannot change before commit.
+        open_ids = set(Question.objects.select_for_update().filter(
+            pk__in={question_id for _, question_id in ballots}, pub_date__lte=now,
+        ).exclude(end_date__lt=now).values_list('pk', flat=True))
+        for key in ballots:
+            if key[1] not in open_ids:
+                statuses[key] = 'closed'
+        return {key: choice_id for key, choice_id in ballots.items() if key[1] in open_ids}
 
-    @property
-    def question(self):
-        return self.choice.question
+    @classmethod
+    def _announce(cls, question_ids):
+        transaction.on_commit(lambda: tallies_changed.send(
+            sender=cls, question_ids=question_ids))
 
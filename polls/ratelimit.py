@@ -0,0 +1,124 @@
+"""Token bucket rate limits of the vote view.
+
+Every vote takes a token from the bucket of the client IP, of the user
+and of the user on that question; a bucket of rate "N/S" holds at most N
+tokens and gets N back every S seconds. Buckets live in a dict of this
+process (the "local" store) or in the cache, shared by every process
+using it (the "cache" store), and are dropped once they are full again.
+The cache store reads and writes buckets without a lock, so concurrent
+processes may let a few extra votes through.
+"""
+import math
+import threading
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+def parse_rate(rate):
+    """Return the (capacity, tokens per second) of an "N/S" rate."""
+    count, seconds = rate.split('/')
+    return float(count), float(count) / float(seconds)
+
+
+class LocalStore:
+    """Buckets kept in this process."""
+
+    # Past this many buckets, full ones are swept out on the next write.
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._buckets = {}
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        return {key: bucket for key, (bucket, expires) in
+                ((key, self._buckets.get(key, (None, 0))) for key in keys) if expires > now}
+
+    def set_many(self, buckets, timeout):
+        now = time.monotonic()
+        if len(self._buckets) > self.MAX_BUCKETS:
+            self._buckets = {key: value for key, value in self._buckets.items() if value[1] > now}
+        self._buckets.update({key: (bucket, now + timeout) for key, bucket in buckets.items()})
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class CacheStore:
+    """Buckets kept in the polls cache, shared by its processes."""
+
+    lock = nullcontext()
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def get_many(self, keys):
+        return self._cache.get_many(keys)
+
+    def set_many(self, buckets, timeout):
+        self._cache.set_many(buckets, math.ceil(timeout))
+
+
+_local = LocalStore()
+
+
+def get_store():
+    """Return the store named by POLLS_VOTE_RATE_LIMIT['STORE']."""
+    if settings.POLLS_VOTE_RATE_LIMIT['STORE'] == 'cache':
+        return CacheStore(caches[getattr(settings, 'POLLS_CACHE_ALIAS', 'default')])
+    return _local
+
+
+def take(store, limits, now=None):
+    """Take a token from each bucket of a {key: (capacity, tokens per
+    second)} mapping, if every one has a token. Return 0 when they did,
+    or else the seconds until they will, taking nothing."""
+    now = time.time() if now is None else now
+    with store.lock:
+        buckets = store.get_many(list(limits))
+        taken = {}
+        wait = 0
+        for key, (capacity, rate) in limits.items():
+            tokens, stamp = buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            taken[key] = (tokens - 1, now)
+        if not wait:
+            store.set_many(taken, max(capacity / rate for capacity, rate in limits.values()))
+    return wait
+
+
+def _too_many(wait):
+    response = HttpResponse('Too many votes, try again later.', status=429,
+                            content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def throttle(request, question_id):
+    """Return a 429 response if a vote on question_id would go over the
+    POLLS_VOTE_RATE_LIMIT rates, or else None. The IP bucket is checked
+    first, so a flood from one address is turned away before the session
+    is read."""
+    config = settings.POLLS_VOTE_RATE_LIMIT
+    if not config['ENABLED']:
+        return None
+    store = get_store()
+    ip = request.META.get('REMOTE_ADDR', '')
+    wait = take(store, {f'polls:rate:ip:{ip}': parse_rate(config['IP'])})
+    if wait:
+        return _too_many(wait)
+    user_id = request.session.get(SESSION_KEY)
+    voter = f'user:{user_id}' if user_id else f'ip:{ip}'
+    limits = {f'polls:rate:{voter}:question:{question_id}': parse_rate(config['QUESTION'])}
+    if user_id:
+        limits[f'polls:rate:{voter}'] = parse_rate(config['USER'])
+    wait = take(store, limits)
+    return _too_many(wait) if wait else None
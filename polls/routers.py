@@ -0,0 +1,99 @@
+"""Route read-mostly polls traffic to read replicas.
+
+Only code running inside replica_reads(), such as the index and results
+views, reads from the aliases in POLLS_READ_REPLICAS; everything else,
+and every write, uses the primary ``default`` database. After a vote the
+voter is pinned to the primary for POLLS_REPLICA_PIN_SECONDS through a
+cookie, so they see their own vote before the replicas catch up.
+"""
+import contextlib
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+
+PIN_COOKIE = 'polls_primary'
+
+_replica_reads = contextvars.ContextVar('polls_replica_reads', default=False)
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """Send the reads made inside the block to a replica."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def reading_from_replica():
+    """Return whether reads made here go to a replica."""
+    return bool(getattr(settings, 'POLLS_READ_REPLICAS', None)) and _replica_reads.get()
+
+
+def is_pinned(request):
+    """Return whether the request must read from the primary."""
+    return PIN_COOKIE in request.COOKIES
+
+
+def pin_to_primary(response):
+    """Pin the client to the primary database for a while after a write."""
+    seconds = getattr(settings, 'POLLS_REPLICA_PIN_SECONDS', 5)
+    if getattr(settings, 'POLLS_READ_REPLICAS', None) and seconds:
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+    return response
+
+
+def replica_view(view):
+    """Make a function view read from a replica unless the client is
+    pinned to the primary."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if is_pinned(request):
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """Make a class-based view read from a replica unless the client is
+    pinned to the primary."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if is_pinned(request):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            async def dispatch():
+                with replica_reads():
+                    return await super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+            return dispatch()
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaRouter:
+    """Database router sending replica reads of polls models to
+    POLLS_READ_REPLICAS. Sessions and users are always read from the
+    primary, so a user who just logged in is never anonymous on a lagging
+    replica."""
+
+    def _replicas(self):
+        return getattr(settings, 'POLLS_READ_REPLICAS', [])
+
+    def db_for_read(self, model, **hints):
+        replicas = self._replicas()
+        if replicas and _replica_reads.get() and model._meta.app_label == 'polls':
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *self._replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,188 @@
+"""Full-text search over question and choice texts.
+
+On SQLite, texts live in the polls_search FTS5 table, which triggers keep
+in step with polls_question and polls_choice; on PostgreSQL, searches use
+the GIN indexes of the same migration. Other backends fall back to an
+unindexed icontains scan. Every word of a query must match, as a word
+prefix, in the question text or in one of its choices. Matches in the
+question text rank above matches in a choice.
+"""
+import importlib
+import re
+
+from django.db import connections, router
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Choice, Question
+
+# Longest number of words of a query that are searched for.
+MAX_TERMS = 8
+
+# Most SQLite matches ranked by relevance; beyond it, newest come first.
+RANKED_MATCHES = 5000
+
+_WORD = re.compile(r'\w+')
+
+_migration = importlib.import_module('polls.migrations.0013_question_search')
+
+
+def terms(query):
+    """Return the words of a query, lowercased."""
+    return _WORD.findall(query.lower())[:MAX_TERMS]
+
+
+def _fts5_query(words):
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _sqlite_ids(connection, words, limit, states):
+    match = _fts5_query(words)
+    in_states = ', '.join(['%s'] * len(states))
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM polls_search WHERE polls_search MATCH %s', [match])
+        if cursor.fetchone()[0] <= RANKED_MATCHES:
+            cursor.execute(f"""
+                SELECT polls_search.question_id, MIN(polls_search.rank
+                    * CASE polls_search.kind WHEN 'question' THEN 2.0 ELSE 1.0 END) AS score
+                FROM polls_search JOIN polls_question
+                    ON polls_question.id = polls_search.question_id
+                WHERE polls_search MATCH %s AND polls_question.state IN ({in_states})
+                GROUP BY polls_search.question_id ORDER BY score, polls_search.question_id
+                LIMIT %s
+            """, [match, *states, -1 if limit is None else limit])
+            return [row[0] for row in cursor.fetchall()]
+        # Ranking scores every match, so terms common to most polls list
+        # the newest matches instead, reading only as many rows as needed.
+        cursor.execute(f"""
+            SELECT polls_search.question_id
+            FROM polls_search JOIN polls_question ON polls_question.id = polls_search.question_id
+            WHERE polls_search MATCH %s AND polls_question.state IN ({in_states})
+            ORDER BY polls_search.rowid DESC
+        """, [match, *states])
+        ids = {}
+        for question_id, in iter(cursor.fetchone, None):
+            ids.setdefault(question_id)
+            if len(ids) == limit:
+                break
+        return list(ids)
+
+
+def _postgresql_ids(using, words, limit, states):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+    query = SearchQuery(' & '.join(f'{word}:*' for word in words),
+                        config='simple', search_type='raw')
+    published = Question.objects.using(using).filter(state__in=states)
+    ranked = {}
+    question_vector = SearchVector('question_text', config='simple')
+    for pk, rank in published.annotate(vector=question_vector).filter(vector=query).annotate(
+            rank=SearchRank(question_vector, query)
+    ).values_list('pk', 'rank').order_by('-rank')[:limit]:
+        ranked[pk] = rank * 2
+    choice_vector = SearchVector('choice_text', config='simple')
+    for pk, rank in Choice.objects.using(using).filter(question__in=published).annotate(
+            vector=choice_vector).filter(vector=query).annotate(
+            rank=SearchRank(choice_vector, query)
+    ).values_list('question_id', 'rank').order_by('-rank')[:limit]:
+        ranked[pk] = max(ranked.get(pk, 0), rank)
+    return sorted(ranked, key=lambda pk: (-ranked[pk], pk))[:limit]
+
+
+def _fallback_ids(using, words, limit, states):
+    questions = Question.objects.using(using).filter(state__in=states)
+    for word in words:
+        questions = questions.filter(Q(question_text__icontains=word) | Q(
+            pk__in=Choice.objects.using(using).filter(choice_text__icontains=word)
+            .values('question_id')))
+    return list(questions.order_by('-pub_date', '-pk').values_list('pk', flat=True)[:limit])
+
+
+def search_ids(query, limit=20, using=None, published_only=True):
+    """Return the ids of the questions matching query, best match first.
+    Upcoming questions are left out unless published_only is False; limit
+    None returns every match."""
+    words = terms(query)
+    if not words:
+        return []
+    states = [Question.State.OPEN, Question.State.CLOSED]
+    if not published_only:
+        states.append(Question.State.SCHEDULED)
+    using = using or router.db_for_read(Question)
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        return _sqlite_ids(connection, words, limit, states)
+    if connection.vendor == 'postgresql':
+        return _postgresql_ids(using, words, limit, states)
+    return _fallback_ids(using, words, limit, states)
+
+
+def matching(query, using=None):
+    """Return a filter selecting every question, upcoming ones included,
+    whose texts match query. It is a subquery, so any number of matches
+    costs no more parameters than one; results come unranked."""
+    words = terms(query)
+    if not words:
+        return Q(pk__in=[])
+    using = using or router.db_for_read(Question)
+    vendor = connections[using].vendor
+    if vendor == 'sqlite':
+        return Q(pk__in=RawSQL('SELECT question_id FROM polls_search WHERE polls_search MATCH %s',
+                               [_fts5_query(words)]))
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+        query = SearchQuery(' & '.join(f'{word}:*' for word in words),
+                            config='simple', search_type='raw')
+        return Q(pk__in=Question.objects.using(using).annotate(
+            vector=SearchVector('question_text', config='simple')).filter(vector=query)
+            .values('pk')) | Q(pk__in=Choice.objects.using(using).annotate(
+                vector=SearchVector('choice_text', config='simple')).filter(vector=query)
+            .values('question_id'))
+    condition = Q()
+    for word in words:
+        condition &= Q(question_text__icontains=word) | Q(
+            pk__in=Choice.objects.using(using).filter(choice_text__icontains=word)
+            .values('question_id'))
+    return condition
+
+
+def search(query, limit=20):
+    """Return the published questions matching query, best match first."""
+    using = router.db_for_read(Question)
+    ids = search_ids(query, limit, using)
+    questions = Question.objects.using(using).in_bulk(ids)
+    return [questions[pk] for pk in ids if pk in questions]
+
+
+def rebuild_index(using='default'):
+    """Recreate the search table or indexes and their triggers from the
+    current rows."""
+    connection = connections[using]
+    statements = {
+        'sqlite': _migration.SQLITE_BACKWARD + _migration.SQLITE_FORWARD,
+        'postgresql': _migration.POSTGRESQL_BACKWARD + _migration.POSTGRESQL_FORWARD,
+    }.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def ensure_index(using='default'):
+    """Rebuild the SQLite search index if a trigger is missing. SQLite
+    drops the triggers of a table when a migration remakes it, so this
+    runs after every migrate. Return whether it rebuilt."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('polls', _migration.__name__.rsplit('.', 1)[1]) not in applied:
+        return False
+    names = [f'polls_search_{model}_{event}' for model in ('question', 'choice')
+             for event in ('insert', 'update', 'delete')]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN "
+                       f"({', '.join(['%s'] * len(names))})", names)
+        if cursor.fetchone()[0] == len(names):
+            return False
+    rebuild_index(using)
+    return True
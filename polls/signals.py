@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import cache, events
+
+# Sent after commit with the ids of the questions whose tallies changed.
+tallies_changed = Signal()
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def release_user_tallies(sender, instance, using, **kwargs):
+    """Take the votes of a deleted user off their choice tallies."""
+    from .models import Vote
+    Vote.release_tallies(Vote.objects.using(using).filter(user=instance))
+
+
+@receiver(tallies_changed)
+def invalidate_results_on_vote(sender, question_ids, **kwargs):
+    """Drop cached results once new tallies are committed."""
+    cache.invalidate_results(question_ids)
+
+
+@receiver(tallies_changed)
+def publish_tallies(sender, question_ids, **kwargs):
+    """Wake the live results streams of the changed questions."""
+    events.publish(question_ids)
+
+
+@receiver(post_save, sender='polls.Question')
+def sync_loaded_state(sender, instance, raw, using, **kwargs):
+    """Store the state of questions loaded from fixtures, which skip save()."""
+    if raw:
+        sender.sync_states(sender.objects.using(using).filter(pk=instance.pk))
+
+
+@receiver(post_save, sender='polls.Question')
+@receiver(post_delete, sender='polls.Question')
+def invalidate_question_caches(sender, instance, **kwargs):
+    """Drop the cached index, results and state boundary of an edited or
+    deleted question."""
+    cache.invalidate_results({instance.pk})
+    cache.invalidate_index()
+    cache.invalidate_lifecycle()
+
+
+@receiver(post_save, sender='polls.Choice')
+@receiver(post_delete, sender='polls.Choice')
+def invalidate_choice_results(sender, instance, **kwargs):
+    """Drop cached results of the question of an edited choice."""
+    cache.invalidate_results({instance.question_id})
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached session user of an edited or deleted user."""
+    cache.invalidate_user(instance.pk)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS, such as WAL journaling, to new SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    """Put back search triggers dropped by SQLite table rebuilds."""
+    if sender.name == 'polls':
+        from . import search
+        search.ensure_index(using)
@@ -0,0 +1,61 @@
+"""Start-up of server processes.
+
+profile_imports() measures how long a fresh interpreter spends importing
+each module of an entry point such as mysite.wsgi. before_fork() and
+after_fork() let pre-fork servers load and warm the application once in
+their master process and share it with every worker; see gunicorn.conf.py.
+"""
+import gc
+import os
+import random
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.db import connections
+
+# "import time: self [us] | cumulative | imported package" lines of -X importtime.
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def profile_imports(module, settings_module=None):
+    """Import module in a fresh interpreter with -X importtime and return a
+    list of {'module', 'self_ms', 'cumulative_ms', 'depth'} dicts, one per
+    module imported, in import order."""
+    env = dict(os.environ)
+    if settings_module:
+        env['DJANGO_SETTINGS_MODULE'] = settings_module
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            check=True, capture_output=True, text=True,
+                            cwd=settings.BASE_DIR, env=env).stderr
+    imports = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            imports.append({'module': name, 'self_ms': int(own) / 1000,
+                            'cumulative_ms': int(cumulative) / 1000,
+                            'depth': len(indent) // 2})
+    return imports
+
+
+def before_fork():
+    """Prepare the master process of a pre-fork server to fork a worker.
+    Database connections are closed so no worker inherits a socket or
+    SQLite handle, and the objects loaded so far are moved out of the
+    garbage collector's reach, so collections in the workers do not touch
+    and copy the pages they share with the master."""
+    from .buffer import forget_tally_buffer
+    forget_tally_buffer(flush=True)
+    connections.close_all()
+    gc.freeze()
+
+
+def after_fork():
+    """Reset the per-process state a new worker inherited from its master."""
+    from . import instrumentation
+    from .buffer import forget_tally_buffer
+    random.seed()
+    forget_tally_buffer(flush=False)
+    instrumentation.registry.reset()
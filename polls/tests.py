@@ -1,11 +1,40 @@
+import asyncio
 import datetime
+import gc
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
 
-from django.test import TestCase
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.template import engines
+from django.templatetags.static import static
+from django.db import connection, connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse
+from django.urls import include, path, reverse
+from django.views import View
+from django.contrib import admin
 from django.contrib.auth.models import User
 
-from .models import Question, Vote
+from mysite import view as site_view
+
+from . import (benchmark, cache, events, instrumentation, ratelimit, routers, search, startup,
+               warmup)
+from . import urls as polls_urls
+from .buffer import VoteCounterBuffer, get_tally_buffer
+from .models import Choice, Question, Vote
+from .pagination import EstimatedCountPaginator
 
 
 def create_question(question_text, days, end=None):
@@ -111,6 +140,7 @@ class QuestionModelTests(TestCase):
 class VoteModelTest(TestCase):
 
     def setUp(self):
+        ratelimit.get_store().clear()
         user = User.objects.create_user("test", "test@mail.com", "tttttttt")
         user.save()
 
@@ -135,6 +165,9 @@ class VoteModelTest(TestCase):
 
 class QuestionIndexViewTests(TestCase):
 
+    def setUp(self):
+        caches['default'].clear()
+
     def test_no_questions(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -256,6 +289,7 @@ class QuestionResultViewTests(TestCase):
 class QuestionVoteViewTest(TestCase):
 
     def setUp(self) -> None:
+        ratelimit.get_store().clear()
         self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
         self.user.save()
 
@@ -279,3 +313,1477 @@ class QuestionVoteViewTest(TestCase):
         self.assertEqual(selected.choice, choice_test2)
         self.assertEqual(Vote.objects.all().count(), 1)
 
+    def test_vote_query_count_is_constant(self):
+        """Voting costs the same number of queries however many votes
+        the user already has."""
+        self.client.login(username="test", password="tttttttt")
+        for i in range(5):
+            other = create_question(question_text=f"other {i}", days=-1)
+            Vote.cast(self.user, other.choice_set.create(choice_text="x"))
+        question = create_question(question_text="test", days=-10)
+        choice = question.choice_set.create(choice_text="one")
+        url = reverse('polls:vote', args=(question.id,))
+        Question.catch_up()
+        with self.assertNumQueries(11):
+            self.client.post(url, {'choice': choice.id})
+        self.assertEqual(Vote.objects.get(user=self.user,
+                                          question=question).choice, choice)
+
+
+class ChoiceTallyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.question = create_question(question_text="test", days=-1)
+        self.one = self.question.choice_set.create(choice_text="one")
+        self.two = self.question.choice_set.create(choice_text="two")
+
+    def test_cast_updates_tallies(self):
+        """Casting and changing a vote moves the stored tallies."""
+        Vote.cast(self.user, self.one)
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.votes(), 1)
+        Vote.cast(self.user, self.two)
+        self.one.refresh_from_db()
+        self.two.refresh_from_db()
+        self.assertEqual((self.one.votes(), self.two.votes()), (0, 1))
+
+    def test_deleted_vote_leaves_tally(self):
+        """Deleting a vote takes it off the tally."""
+        vote, _ = Vote.cast(self.user, self.one)
+        vote.delete()
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.votes(), 0)
+
+    def test_bulk_deletes_adjust_tallies(self):
+        """Deleting votes in bulk or with their user takes them off the
+        tallies with one UPDATE."""
+        voters = [User.objects.create_user(f"voter{n}") for n in range(4)]
+        for voter in voters:
+            Vote.cast(voter, self.one)
+        Vote.cast(self.user, self.two)
+        with CaptureQueriesContext(connection) as queries:
+            Vote.objects.filter(user__in=voters[:2]).delete()
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('UPDATE "polls_choice"')]), 1)
+        voters[2].delete()
+        self.one.refresh_from_db()
+        self.two.refresh_from_db()
+        self.assertEqual((self.one.votes(), self.two.votes()), (1, 1))
+
+    def test_question_delete_is_fast(self):
+        """Deleting a question deletes its votes in one query, whatever
+        their number."""
+        def delete_queries(votes):
+            question = create_question(question_text=f"{votes} votes", days=-1)
+            choice = question.choice_set.create(choice_text="one")
+            for n in range(votes):
+                Vote.cast(User.objects.create_user(f"{votes}-{n}"), choice)
+            with CaptureQueriesContext(connection) as queries:
+                question.delete()
+            return len(queries)
+        self.assertEqual(delete_queries(1), delete_queries(20))
+        self.assertFalse(Vote.objects.filter(question__question_text__endswith="votes").exists())
+
+    def test_rebuild_tallies(self):
+        """rebuild_tallies repairs a drifted tally."""
+        Vote.cast(self.user, self.one)
+        Choice.objects.update(vote_count=42)
+        call_command('rebuild_tallies', stdout=open(os.devnull, 'w'))
+        self.one.refresh_from_db()
+        self.two.refresh_from_db()
+        self.assertEqual((self.one.votes(), self.two.votes()), (1, 0))
+
+    def test_results_query_count(self):
+        """The results page does not count votes per choice."""
+        for i in range(5):
+            self.question.choice_set.create(choice_text=f"extra {i}")
+        Question.catch_up()
+        with self.assertNumQueries(2):
+            self.client.get(reverse('polls:results', args=(self.question.id,)))
+
+
+class VoteCounterBufferTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        question = create_question(question_text="test", days=-1)
+        self.one = question.choice_set.create(choice_text="one")
+        self.two = question.choice_set.create(choice_text="two")
+
+    def test_flush_merges_shards(self):
+        """Deltas from every shard are summed and written in one flush."""
+        buffer = VoteCounterBuffer(Choice.adjust_tallies, shards=4, autostart=False)
+        writers = [threading.Thread(target=buffer.add, args=(deltas,)) for deltas in (
+            {self.one.pk: 1}, {self.one.pk: 1, self.two.pk: 1}, {self.two.pk: -1})]
+        for writer in writers:
+            writer.start()
+            writer.join()
+        self.assertEqual(sum(1 for shard in buffer._shards if shard.deltas), 3)
+        self.assertEqual(buffer.pending(self.one.pk), 2)
+        self.assertEqual(buffer.metrics()['buffered_deltas'], 4)
+        self.assertEqual(buffer.flush(), 1)
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.vote_count, 2)
+        self.assertEqual(buffer.metrics()['buffered_deltas'], 0)
+        self.assertEqual(buffer.metrics()['flush_lag_seconds'], 0.0)
+
+    def test_failed_flush_keeps_deltas(self):
+        """Deltas survive a flush that raises."""
+        def broken(deltas):
+            raise RuntimeError
+        buffer = VoteCounterBuffer(broken, autostart=False)
+        buffer.add({self.one.pk: 1})
+        with self.assertLogs('polls.buffer', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending(self.one.pk), 1)
+        self.assertEqual(buffer.metrics()['flush_errors'], 1)
+
+    @override_settings(POLLS_VOTE_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL': 60})
+    def test_vote_is_buffered_until_flush(self):
+        """With write-behind on, the tally is deferred but still reported."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.user, self.one)
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.vote_count, 0)
+        self.assertEqual(self.one.votes(), 1)
+        get_tally_buffer().flush()
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.vote_count, 1)
+
+
+class ResultsCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.question = create_question(question_text="test", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="one")
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def test_warm_cache_costs_no_queries(self):
+        """A cached results page is served without touching the database."""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, self.choice.choice_text)
+
+    def test_vote_invalidates_results(self):
+        """A committed vote drops the cached results of its question."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.user, self.choice)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertContains(response, f'id="votes{self.choice.id}">1<')
+
+    @override_settings(POLLS_RESULTS_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        """A zero timeout renders every request."""
+        self.client.get(self.url)
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+
+class IndexCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_warm_index_costs_no_queries(self):
+        """The cached index list is served without touching the database."""
+        create_question(question_text="Past question.", days=-1)
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Past question.")
+
+    def test_saved_question_invalidates_index(self):
+        """A new or edited question shows up on the next index request."""
+        self.client.get(reverse('polls:index'))
+        question = create_question(question_text="New question.", days=-1)
+        self.assertContains(self.client.get(reverse('polls:index')), "New question.")
+        question.question_text = "Edited question."
+        question.save()
+        self.assertContains(self.client.get(reverse('polls:index')), "Edited question.")
+        question.delete()
+        self.assertContains(self.client.get(reverse('polls:index')),
+                            "No polls are available.")
+
+    def test_next_boundary(self):
+        """next_boundary is the nearest future pub_date or end_date."""
+        now = timezone.now()
+        self.assertIsNone(Question.next_boundary(now))
+        create_question(question_text="Later.", days=3)
+        create_question(question_text="Ending.", days=-1, end=2)
+        self.assertEqual(Question.next_boundary(now),
+                         Question.objects.get(question_text="Ending.").end_date)
+
+
+class QuestionDetailQueryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.client.login(username="test", password="tttttttt")
+        self.question = create_question(question_text="test", days=-1)
+        self.choices = [self.question.choice_set.create(choice_text=f"choice {i}")
+                        for i in range(10)]
+
+    def test_detail_query_count(self):
+        """The detail page costs a fixed number of queries however many
+        choices and votes exist."""
+        for i in range(5):
+            other = create_question(question_text=f"other {i}", days=-1)
+            Vote.cast(self.user, other.choice_set.create(choice_text="x"))
+        Vote.cast(self.user, self.choices[3])
+        url = reverse('polls:detail', args=(self.question.id,))
+        Question.catch_up()
+        # session, user, question, choices, current vote
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.context['check'], self.choices[3].id)
+        self.assertContains(response, f'value="{self.choices[3].id}" checked')
+
+    def test_same_text_choices(self):
+        """Only the voted choice is checked when choices share their text."""
+        one = self.question.choice_set.create(choice_text="same")
+        self.question.choice_set.create(choice_text="same")
+        Vote.cast(self.user, one)
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, 'checked', count=1)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed_and_run(self):
+        """The harness seeds the requested scale and reports every endpoint."""
+        scale = benchmark.seed(questions=20, choices=3, users=5, votes=50)
+        self.assertEqual(scale['votes'], 50)
+        self.assertEqual(Vote.objects.count(), 50)
+        self.assertEqual(sum(Choice.objects.values_list('vote_count', flat=True)), 50)
+        report = benchmark.run(requests=5, concurrency=1)
+        self.assertEqual(set(report['endpoints']), set(benchmark.ENDPOINTS))
+        for result in report['endpoints'].values():
+            self.assertEqual(result['requests'], 5)
+            self.assertEqual(result['errors'], 0)
+            self.assertIsNotNone(result['latency_ms']['p99'])
+
+
+class TransferTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.question = create_question(question_text="test", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="one")
+        Vote.cast(self.user, self.choice)
+
+    def export(self, *args):
+        output = io.StringIO()
+        call_command('export_polls', *args, stdout=output)
+        return output.getvalue()
+
+    def test_jsonl_round_trip(self):
+        """Exported JSON Lines import back into an empty database."""
+        exported = self.export()
+        self.assertEqual(len(exported.splitlines()), 4)
+        User.objects.all().delete()
+        Question.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as data:
+            data.write(exported)
+        self.addCleanup(os.remove, data.name)
+        call_command('import_polls', data.name, '--batch-size', '1', stdout=io.StringIO())
+        vote = Vote.objects.get()
+        self.assertEqual((vote.user, vote.question, vote.choice),
+                         (self.user, self.question, self.choice))
+        self.assertEqual(Choice.objects.get().vote_count, 1)
+        # Sequences were moved past the imported keys.
+        self.assertGreater(create_question(question_text="new", days=-1).pk, self.question.pk)
+
+    def test_duplicate_import(self):
+        """Importing rows that already exist names the batch that failed."""
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as data:
+            data.write(self.export())
+        self.addCleanup(os.remove, data.name)
+        with self.assertRaisesMessage(CommandError, f'{data.name} line 1: '):
+            call_command('import_polls', data.name, stdout=io.StringIO())
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_unknown_choice(self):
+        """A vote for a missing choice is reported with its line."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as data:
+            data.write(f"pk,choice,user\n,{self.choice.pk + 100},{self.user.pk}\n")
+        self.addCleanup(os.remove, data.name)
+        with self.assertRaisesMessage(CommandError, f'{data.name} line 2: unknown choice'):
+            call_command('import_polls', data.name, '--format', 'csv', '--model', 'vote',
+                         stdout=io.StringIO())
+
+    def test_csv_vote_import_resolves_question(self):
+        """CSV votes without a question column get it from their choice."""
+        other = User.objects.create_user("other")
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as data:
+            data.write(f"pk,choice,user\n,{self.choice.pk},{other.pk}\n")
+        self.addCleanup(os.remove, data.name)
+        call_command('import_polls', data.name, '--format', 'csv', '--model', 'vote',
+                     stdout=io.StringIO())
+        vote = Vote.objects.get(user=other)
+        self.assertEqual(vote.question, self.question)
+        self.assertIsNone(vote.voted_at)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 2)
+
+    def test_csv_export(self):
+        """CSV export writes a header and one row per object."""
+        rows = self.export('--format', 'csv', '--model', 'question').splitlines()
+        self.assertEqual(rows[0], 'pk,question_text,pub_date,end_date')
+        self.assertEqual(len(rows), 2)
+
+
+class AsyncUrls:
+    """URLconf serving every polls route with its async view."""
+    urlpatterns = [
+        path('polls/', include((polls_urls.routes(benchmark.ENDPOINTS), 'polls'))),
+        path('accounts/', include('django.contrib.auth.urls')),
+    ]
+
+
+class LoopCheckingCache(LocMemCache):
+    """Local memory cache that refuses sync calls from an event loop, where
+    a file or database cache would block it."""
+
+    def _check(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        raise SynchronousOnlyOperation('Sync cache call on the event loop.')
+
+    def get(self, *args, **kwargs):
+        self._check()
+        return super().get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self._check()
+        return super().set(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        self._check()
+        return super().add(*args, **kwargs)
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls, CACHES={'default': {
+    'BACKEND': 'polls.tests.LoopCheckingCache', 'LOCATION': 'async-views'}})
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        ratelimit.get_store().clear()
+        caches['default'].clear()
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.question = create_question(question_text="Past question.", days=-1)
+        self.one = self.question.choice_set.create(choice_text="one")
+        self.two = self.question.choice_set.create(choice_text="two")
+
+    async def test_index(self):
+        """The async index lists published questions only."""
+        await sync_to_async(create_question)(question_text="Future question.", days=3)
+        response = await self.async_client.get(reverse('polls:index'))
+        self.assertContains(response, "Past question.")
+        self.assertNotContains(response, "Future question.")
+
+    async def test_detail_requires_login(self):
+        """Anonymous users are sent to the login page."""
+        response = await self.async_client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response.url)
+
+    async def test_vote_and_results(self):
+        """An async vote shows up on the async results page."""
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(reverse('polls:vote', args=(self.question.id,)),
+                                                {'choice': self.two.id})
+        self.assertEqual(response.url, reverse('polls:results', args=(self.question.id,)))
+        response = await self.async_client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.context['check'], self.two.id)
+        response = await self.async_client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, f'id="votes{self.two.id}">1<')
+
+    async def test_vote_without_choice(self):
+        """Posting no choice renders the detail page with an error."""
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(reverse('polls:vote', args=(self.question.id,)))
+        self.assertContains(response, "You didn&#x27;t select a choice.")
+
+    async def test_cached_pages(self):
+        """Index and results pages are cached and revalidated through the
+        async cache API."""
+        for name, args in (('polls:index', ()), ('polls:results', (self.question.id,))):
+            first = await self.async_client.get(reverse(name, args=args))
+            self.assertEqual(first.status_code, 200)
+            again = await self.async_client.get(reverse(name, args=args),
+                                                headers={'If-None-Match': first['ETag']})
+            self.assertEqual(again.status_code, 304)
+
+    async def test_future_results_redirect(self):
+        """Results of an unpublished question redirect to the index."""
+        future = await sync_to_async(create_question)(question_text="Future.", days=3)
+        response = await self.async_client.get(reverse('polls:results', args=(future.id,)))
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls, CACHES={'default': {
+    'BACKEND': 'polls.tests.LoopCheckingCache', 'LOCATION': 'async-benchmark'}})
+class AsyncBenchmarkTests(TransactionTestCase):
+    """Requests of the ASGI benchmark mode run on threads of their own, so
+    their data must be committed."""
+
+    def test_run_async_views(self):
+        """The ASGI benchmark mode drives the async views from concurrent
+        coroutines without errors."""
+        benchmark.seed(questions=20, choices=3, users=5, votes=50)
+        report = benchmark.run(requests=8, concurrency=4, asgi=True)
+        self.assertEqual(set(report['endpoints']), set(benchmark.ENDPOINTS))
+        for result in report['endpoints'].values():
+            self.assertEqual(result['requests'], 8)
+            self.assertEqual(result['errors'], 0)
+
+
+@override_settings(POLLS_SSE_TICK=0.01, POLLS_LIVE_RESULTS=True)
+class LiveResultsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.question = create_question(question_text="test", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="one")
+
+    async def test_updates_are_coalesced(self):
+        """Several votes within a tick reach watchers as one message."""
+        broadcaster = events.TallyBroadcaster()
+        async with broadcaster.subscribe(self.question.id) as first, \
+                broadcaster.subscribe(self.question.id) as second:
+            initial = json.loads(await first.get())
+            self.assertEqual(initial['choices'][0]['votes'], 0)
+            await second.get()
+            await sync_to_async(Vote.cast)(self.user, self.choice)
+            broadcaster.publish({self.question.id})
+            broadcaster.publish({self.question.id})
+            updates = [json.loads(await asyncio.wait_for(queue.get(), 1))
+                       for queue in (first, second)]
+            self.assertEqual([update['choices'][0]['votes'] for update in updates], [1, 1])
+            self.assertTrue(first.empty())
+        self.assertEqual(broadcaster.channels, {})
+
+    async def test_stream_endpoint(self):
+        """The stream endpoint answers with an uncached event stream."""
+        response = await self.async_client.get(
+            reverse('polls:results_stream', args=(self.question.id,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    async def test_stream_sends_tallies(self):
+        """The stream sends the current tallies as an SSE event."""
+        stream = events.stream(self.question.id)
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        event = await anext(stream)
+        self.assertTrue(event.startswith('event: tallies\ndata: '))
+        await stream.aclose()
+
+    def test_no_stream_over_wsgi(self):
+        """WSGI requests get no stream and no live results page."""
+        url = reverse('polls:results_stream', args=(self.question.id,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertNotContains(response, url)
+
+    @override_settings(POLLS_LIVE_RESULTS=False)
+    async def test_no_stream_when_off(self):
+        """The stream is off unless live results are turned on."""
+        response = await self.async_client.get(
+            reverse('polls:results_stream', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_unpublished_stream(self):
+        """Unpublished questions have no stream."""
+        future = await sync_to_async(create_question)(question_text="Future.", days=3)
+        response = await self.async_client.get(reverse('polls:results_stream', args=(future.id,)))
+        self.assertEqual(response.status_code, 404)
+
+
+class DatabaseProfileTests(TestCase):
+
+    def test_sqlite_pragmas_applied(self):
+        """New SQLite connections get the configured PRAGMAs."""
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+
+class SQLiteTransactionModeTests(TransactionTestCase):
+
+    def test_vote_in_immediate_transaction(self):
+        """Vote.cast takes the SQLite write lock when its transaction begins."""
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        user = User.objects.create_user("test")
+        choice = create_question(question_text="test", days=-1).choice_set.create(choice_text="one")
+        with CaptureQueriesContext(connection) as queries:
+            Vote.cast(user, choice)
+        # The first query looks for an unchanged vote outside the transaction.
+        self.assertEqual(queries[1]['sql'],
+                         f"BEGIN {settings.DATABASES['default']['OPTIONS']['transaction_mode']}")
+        self.assertEqual(Vote.objects.get().choice, choice)
+
+
+class ReplicaProbeView(routers.ReplicaReadMixin, View):
+    """Reports the database the router would read from."""
+
+    def get(self, request):
+        return HttpResponse(routers.ReplicaRouter().db_for_read(Question))
+
+
+@override_settings(POLLS_READ_REPLICAS=['replica1'])
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        ratelimit.get_store().clear()
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_default_outside_replica_views(self):
+        """Reads go to the primary unless a view asks for a replica."""
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Question), 'replica1')
+            self.assertEqual(self.router.db_for_write(Question), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_replica_view(self):
+        """A replica view reads from a replica, or from the primary once
+        the client is pinned."""
+        view = ReplicaProbeView.as_view()
+        self.assertEqual(view(self.factory.get('/')).content, b'replica1')
+        pinned = self.factory.get('/')
+        pinned.COOKIES[routers.PIN_COOKIE] = '1'
+        self.assertEqual(view(pinned).content, b'default')
+
+    @override_settings(POLLS_REPLICA_PIN_SECONDS=2)
+    def test_replica_cache_timeout(self):
+        """Values read from a replica are cached no longer than the pin."""
+        self.assertEqual(cache._timeout(300), 300)
+        with routers.replica_reads():
+            self.assertEqual(cache._timeout(300), 2)
+
+    @override_settings(POLLS_READ_REPLICAS=[])
+    def test_no_replicas(self):
+        """Without replicas everything reads from the primary."""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Question), 'default')
+
+    def test_vote_pins_to_primary(self):
+        """Voting sets the cookie that pins the voter to the primary."""
+        User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.client.login(username="test", password="tttttttt")
+        question = create_question(question_text="test", days=-1)
+        choice = question.choice_set.create(choice_text="one")
+        response = self.client.post(reverse('polls:vote', args=(question.id,)),
+                                    {'choice': choice.id})
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'],
+                         settings.POLLS_REPLICA_PIN_SECONDS)
+
+
+@override_settings(POLLS_READ_REPLICAS=['replica1'])
+class ReplicaDatabaseTests(TestCase):
+    """Reads through a second SQLite database holding different rows. The
+    replica alias is added and migrated here rather than in the settings,
+    so it only exists for these tests."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings['replica1'] = {
+            **connections.settings['default'],
+            'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3'),
+            'TEST': {**connections.settings['default']['TEST'], 'MIRROR': None}}
+        call_command('migrate', database='replica1', verbosity=0)
+        cls.databases = {'default', 'replica1'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        caches['default'].clear()
+        create_question("Primary question?", days=-1)
+        Question.objects.using('replica1').create(
+            question_text="Replica question?", pub_date=timezone.now() - datetime.timedelta(days=1))
+        self.user = User.objects.create_user("primary", "primary@mail.com", "tttttttt")
+
+    def test_replica_and_pinned_reads(self):
+        """Replica views read polls rows from the replica, pinned clients
+        and other models from the primary."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Replica question?")
+        self.assertNotContains(response, "Primary question?")
+        self.assertContains(response, "Hello! primary")
+        self.client.cookies[routers.PIN_COOKIE] = '1'
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Primary question?")
+        self.assertNotContains(response, "Replica question?")
+
+    def test_pinned_results_after_replica_read(self):
+        """A voter pinned to the primary sees their vote even when another
+        client rendered the new results version from the lagging replica."""
+        self.client.force_login(self.user)
+        for urlconf in (settings.ROOT_URLCONF, AsyncUrls):
+            with self.subTest(urlconf=urlconf), self.settings(ROOT_URLCONF=urlconf):
+                question = create_question("Shared question?", days=-1)
+                choice = question.choice_set.create(choice_text="Yes")
+                Question.objects.using('replica1').create(
+                    pk=question.pk, question_text=question.question_text,
+                    pub_date=question.pub_date, state=question.state)
+                Choice.objects.using('replica1').create(pk=choice.pk, question_id=question.pk,
+                                                        choice_text="Yes")
+                url = reverse('polls:results', args=(question.id,))
+                response = self.client.post(reverse('polls:vote', args=(question.id,)),
+                                            {'choice': choice.id})
+                self.assertIn(routers.PIN_COOKIE, response.cookies)
+                stale = self.client_class().get(url)
+                self.assertContains(stale, f'id="votes{choice.id}">0<')
+                response = self.client.get(url, headers={'If-None-Match': stale['ETag']})
+                self.assertContains(response, f'id="votes{choice.id}">1<')
+                self.assertNotEqual(response['ETag'], stale['ETag'])
+
+
+@override_settings(POLLS_INSTRUMENTATION_SAMPLE_RATE=1.0, POLLS_METRICS_TOKEN='secret')
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.addCleanup(instrumentation.registry.reset)
+        caches['default'].clear()
+
+    def test_records_view_metrics(self):
+        """Sampled requests record queries, SQL, render and wall time by view."""
+        question = create_question(question_text="test", days=-1)
+        question.choice_set.create(choice_text="one")
+        self.client.get(reverse('polls:results', args=(question.id,)))
+        views = instrumentation.registry.snapshot()
+        histograms = views['polls:results']['histograms']
+        self.assertEqual(histograms['wall_seconds']['count'], 1)
+        self.assertGreater(histograms['queries']['sum'], 0)
+        self.assertGreater(histograms['render_seconds']['sum'], 0)
+        self.assertLessEqual(histograms['sql_seconds']['sum'],
+                             histograms['wall_seconds']['sum'])
+
+    def test_duplicate_queries(self):
+        """Queries repeated within one request are reported by fingerprint."""
+        probe = instrumentation._Probe()
+        with connection.execute_wrapper(probe):
+            for pk in (1, 2):
+                list(Question.objects.filter(pk=pk))
+            list(Question.objects.filter(pk__in=[1, 2, 3]))
+        instrumentation.registry.record('probe', 0.01, probe)
+        duplicates = instrumentation.registry.snapshot()['probe']['duplicate_queries']
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(duplicates[0]['count'], 2)
+        self.assertEqual(instrumentation.fingerprint('x IN (%s, %s,%s)'), 'x IN (...)')
+
+    def test_async_chain(self):
+        """Under ASGI the middleware chain stays async."""
+        self.assertTrue(iscoroutinefunction(ASGIHandler()._middleware_chain))
+
+    @override_settings(ROOT_URLCONF=AsyncUrls)
+    async def test_records_async_view_metrics(self):
+        """Queries of async views are counted too."""
+        question = await sync_to_async(create_question)(question_text="test", days=-1)
+        await self.async_client.get(reverse('polls:results', args=(question.id,)))
+        histograms = instrumentation.registry.snapshot()['polls:results']['histograms']
+        self.assertGreater(histograms['queries']['sum'], 0)
+
+    @override_settings(POLLS_INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_sampling_off(self):
+        """A zero sample rate records nothing."""
+        self.client.get(reverse('polls:index'))
+        self.assertEqual(instrumentation.registry.snapshot(), {})
+
+    def test_metrics_endpoint(self):
+        """Metrics are served to staff and to the bearer token only."""
+        url = reverse('polls:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.create_user("staff", "staff@mail.com", "tttttttt", is_staff=True)
+        self.client.login(username="staff", password="tttttttt")
+        self.client.get(reverse('polls:index'))
+        response = self.client.get(url)
+        self.assertIn('polls:index', response.json()['views'])
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secrets').status_code, 403)
+        response = self.client.get(url, {'format': 'prometheus'},
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, '# TYPE polls_view_wall_seconds histogram')
+        self.assertContains(response, 'polls_view_queries_bucket{view="polls:index",le="+Inf"} 1')
+
+
+@override_settings(POLLS_API_TOKEN='secret', POLLS_BULK_VOTE_MAX=100)
+class BulkVoteTests(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f"user{i}") for i in range(3)]
+        self.question = create_question(question_text="open", days=-1)
+        self.one = self.question.choice_set.create(choice_text="one")
+        self.two = self.question.choice_set.create(choice_text="two")
+        self.url = reverse('polls:bulk_vote')
+
+    def post(self, votes, **extra):
+        extra.setdefault('HTTP_AUTHORIZATION', 'Bearer secret')
+        return self.client.post(self.url, json.dumps({'votes': votes}),
+                                content_type='application/json', **extra)
+
+    def ballot(self, user, choice):
+        return {'user': user.id, 'question': choice.question_id, 'choice': choice.id}
+
+    def test_bulk_vote(self):
+        """Ballots create, replace and supersede votes and keep tallies."""
+        Vote.cast(self.users[0], self.one)
+        Vote.cast(self.users[1], self.one)
+        response = self.post([
+            self.ballot(self.users[0], self.two),
+            self.ballot(self.users[1], self.one),
+            self.ballot(self.users[2], self.one),
+            self.ballot(self.users[2], self.two),
+        ])
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['replaced', 'unchanged', 'superseded', 'created'])
+        self.assertEqual(response.json()['summary']['replaced'], 1)
+        self.assertEqual(Vote.objects.get(user=self.users[2]).choice, self.two)
+        self.one.refresh_from_db()
+        self.two.refresh_from_db()
+        self.assertEqual((self.one.vote_count, self.two.vote_count), (1, 2))
+
+    def test_rejected_ballots(self):
+        """Invalid ballots are rejected without touching the others."""
+        closed = create_question(question_text="closed", days=-5, end=-1)
+        closed_choice = closed.choice_set.create(choice_text="late")
+        other = create_question(question_text="other", days=-1)
+        response = self.post([
+            {'user': self.users[0].id},
+            {'user': 999, 'question': self.question.id, 'choice': self.one.id},
+            {'user': self.users[0].id, 'question': other.id, 'choice': self.one.id},
+            self.ballot(self.users[0], closed_choice),
+            self.ballot(self.users[0], self.one),
+        ])
+        errors = [result.get('error') for result in response.json()['results']]
+        self.assertEqual(errors, ['invalid', 'unknown_user', 'unknown_choice', 'closed', None])
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_closed_while_checking(self):
+        """A question that closed before the votes are written rejects them
+        without announcing a tally change."""
+        Question.catch_up()
+        Question.objects.filter(pk=self.question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(seconds=1))
+        cache.set_lifecycle_boundary(False)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post([self.ballot(self.users[0], self.one)])
+        self.assertEqual(response.json()['results'], [{'status': 'rejected', 'error': 'closed'}])
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(callbacks, [])
+
+    def test_query_count_is_constant(self):
+        """A batch costs the same queries however many ballots it holds."""
+        users = [User(username=f"voter{i}") for i in range(50)]
+        User.objects.bulk_create(users)
+        votes = [{'user': user.id, 'question': self.question.id, 'choice': self.one.id}
+                 for user in User.objects.filter(username__startswith="voter")]
+        with CaptureQueriesContext(connection) as queries:
+            self.post(votes)
+        self.assertLess(len(queries), 15)
+        self.one.refresh_from_db()
+        self.assertEqual(self.one.vote_count, 50)
+
+    def test_authentication(self):
+        """Batches need the token or a staff session, and a size limit holds."""
+        self.assertEqual(self.post([], HTTP_AUTHORIZATION='').status_code, 403)
+        self.assertEqual(self.post([], HTTP_AUTHORIZATION='Bearer secrets').status_code, 403)
+        self.assertEqual(self.post([{}] * 101).status_code, 413)
+        self.assertEqual(self.client.post(self.url, 'nope', content_type='application/json',
+                                          HTTP_AUTHORIZATION='Bearer secret').status_code, 400)
+        User.objects.create_user("staff", password="tttttttt", is_staff=True)
+        self.client.login(username="staff", password="tttttttt")
+        self.assertEqual(self.post([], HTTP_AUTHORIZATION='').status_code, 200)
+
+
+@override_settings(POLLS_API_TOKEN='secret')
+class AnalyticsTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.users = [User.objects.create_user(f"user{i}") for i in range(4)]
+        self.first = create_question(question_text="first", days=-1)
+        self.second = create_question(question_text="second", days=-1)
+        self.a, self.b = (self.first.choice_set.create(choice_text=text) for text in "ab")
+        self.x, self.y = (self.second.choice_set.create(choice_text=text) for text in "xy")
+
+    def get(self, **params):
+        return self.client.get(reverse('polls:analytics'), params,
+                               HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_vote_timestamps(self):
+        """Votes record when they were cast and how often they changed."""
+        vote, _ = Vote.cast(self.users[0], self.a)
+        self.assertIsNotNone(vote.voted_at)
+        self.assertEqual(vote.changes, 0)
+        Vote.cast(self.users[0], self.b)
+        vote.refresh_from_db()
+        self.assertEqual(vote.changes, 1)
+        self.assertGreaterEqual(vote.changed_at, vote.voted_at)
+
+    def test_report(self):
+        """The report holds percentages, curves, changes and correlations."""
+        for user in self.users[:3]:
+            Vote.cast(user, self.a)
+            Vote.cast(user, self.x)
+        Vote.cast(self.users[3], self.b)
+        Vote.cast(self.users[3], self.y)
+        Vote.cast(self.users[0], self.a)
+        Vote.cast(self.users[2], self.y)
+        Vote.cast(self.users[2], self.x)
+        ids = f"{self.first.id},{self.second.id}"
+        data = self.get(questions=ids, bucket=60).json()
+        first, second = data['questions']
+        self.assertEqual([choice['percentage'] for choice in first['choices']], [75.0, 25.0])
+        self.assertEqual(second['changed_votes'], 1)
+        self.assertEqual(second['vote_changes'], 2)
+        self.assertEqual(sum(map(sum, first['curve']['counts'].values())), 4)
+        pair = data['correlations'][0]
+        self.assertEqual(pair['common_voters'], 4)
+        self.assertAlmostEqual(pair['cramers_v'], 1.0)
+
+    def test_report_is_cached_until_a_vote(self):
+        """Reports come from the cache until one of their questions changes."""
+        Vote.cast(self.users[0], self.a)
+        self.get(questions=str(self.first.id))
+        with self.assertNumQueries(0):
+            self.get(questions=str(self.first.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.users[1], self.a)
+        self.assertEqual(self.get(questions=str(self.first.id)).json()['questions'][0]['votes'], 2)
+
+    def test_bad_requests(self):
+        """Questions are required and access needs staff or the token."""
+        self.assertEqual(self.get().status_code, 400)
+        self.assertEqual(self.get(questions="x").status_code, 400)
+        response = self.client.get(reverse('polls:analytics'), {'questions': self.first.id})
+        self.assertEqual(response.status_code, 403)
+
+
+class QuestionLifecycleTests(TestCase):
+
+    def setUp(self):
+        ratelimit.get_store().clear()
+        caches['default'].clear()
+
+    def test_saved_state(self):
+        """Saving a question stores the state of its dates."""
+        self.assertEqual(create_question("Later.", days=2).state, Question.State.SCHEDULED)
+        question = create_question("Now.", days=-1, end=1)
+        self.assertEqual(question.state, Question.State.OPEN)
+        self.assertEqual(question.next_transition, question.end_date)
+        self.assertEqual(create_question("Over.", days=-2, end=-1).state,
+                         Question.State.CLOSED)
+
+    def test_advance(self):
+        """advance() moves questions whose transition came due."""
+        later = create_question("Later.", days=1, end=2)
+        forever = create_question("Forever.", days=-1)
+        moved = Question.advance(timezone.now() + datetime.timedelta(days=1, hours=1))
+        self.assertEqual(moved, [later.id])
+        later.refresh_from_db()
+        self.assertEqual(later.state, Question.State.OPEN)
+        self.assertEqual(later.next_transition, later.end_date)
+        Question.advance(timezone.now() + datetime.timedelta(days=3))
+        later.refresh_from_db()
+        forever.refresh_from_db()
+        self.assertEqual((later.state, later.next_transition), (Question.State.CLOSED, None))
+        self.assertEqual(forever.state, Question.State.OPEN)
+
+    def test_catch_up(self):
+        """Views move due questions themselves and drop the stale index."""
+        question = create_question("Soon.", days=1)
+        self.assertContains(self.client.get(reverse('polls:index')), "No polls are available.")
+        with self.assertNumQueries(0):
+            Question.catch_up()
+        Question.objects.filter(pk=question.pk).update(
+            pub_date=timezone.now() - datetime.timedelta(minutes=1),
+            next_transition=timezone.now() - datetime.timedelta(minutes=1))
+        caches['default'].delete(cache.LIFECYCLE)
+        self.assertContains(self.client.get(reverse('polls:index')), "Soon.")
+
+    def test_vote_on_closed_question(self):
+        """Votes on a closed question are refused."""
+        user = User.objects.create_user("test", "test@mail.com", "tttttttt")
+        self.client.force_login(user)
+        question = create_question("Over.", days=-2, end=-1)
+        choice = question.choice_set.create(choice_text="late")
+        response = self.client.post(reverse('polls:vote', args=(question.id,)),
+                                    {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertFalse(Vote.objects.exists())
+
+    def test_command(self):
+        """The advance_questions command moves due questions once."""
+        question = create_question("Soon.", days=1)
+        Question.objects.filter(pk=question.pk).update(
+            pub_date=timezone.now(), next_transition=timezone.now())
+        out = io.StringIO()
+        call_command('advance_questions', stdout=out)
+        self.assertIn('1 question', out.getvalue())
+        question.refresh_from_db()
+        self.assertEqual(question.state, Question.State.OPEN)
+
+
+@override_settings(POLLS_ARCHIVE_PAGE_SIZE=10)
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.questions = [create_question(f"Question {i}.", days=-30 + i) for i in range(25)]
+        # Two questions sharing a pub_date still page in a stable order.
+        Question.objects.filter(pk=self.questions[5].pk).update(
+            pub_date=self.questions[6].pub_date)
+        self.upcoming = create_question("Upcoming.", days=5)
+        self.closed = create_question("Closed.", days=-40, end=-35)
+
+    def walk(self, **params):
+        params['format'] = 'json'
+        seen = []
+        url = reverse('polls:archive') + '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(item['id'] for item in data['results'])
+            url = data['next']
+        return seen
+
+    def test_pages_cover_every_question_once(self):
+        """Following next cursors lists every published question once,
+        newest first."""
+        seen = self.walk()
+        self.assertEqual(len(seen), 26)
+        self.assertEqual(len(set(seen)), 26)
+        self.assertNotIn(self.upcoming.id, seen)
+        self.assertEqual(seen[-1], self.closed.id)
+
+    def test_previous_cursor(self):
+        """The previous cursor returns to the page before."""
+        first = self.client.get(reverse('polls:archive'), {'format': 'json'}).json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_status_filter(self):
+        """Status filters by stored state; upcoming polls are staff only."""
+        self.assertEqual(self.walk(status='closed'), [self.closed.id])
+        response = self.client.get(reverse('polls:archive'), {'status': 'upcoming'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_query_count(self):
+        """A page deep in the archive costs the same queries as the first."""
+        Question.catch_up()
+        data = self.client.get(reverse('polls:archive'), {'format': 'json'}).json()
+        data = self.client.get(data['next']).json()
+        with self.assertNumQueries(1):
+            response = self.client.get(data['next'])
+        self.assertContains(response, "Closed.")
+
+    def test_html_and_bad_cursor(self):
+        """The archive renders as HTML and rejects malformed cursors."""
+        response = self.client.get(reverse('polls:archive'))
+        self.assertContains(response, "Question 24.")
+        self.assertContains(response, "Older")
+        self.assertEqual(self.client.get(reverse('polls:archive'),
+                                         {'after': 'nonsense'}).status_code, 400)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.python = create_question("Favourite programming language?", days=-2)
+        self.python.choice_set.create(choice_text="Python")
+        self.food = create_question("Best Python snack?", days=-1)
+        self.food.choice_set.create(choice_text="Pizza")
+        self.upcoming = create_question("Python upcoming?", days=3)
+
+    def test_search_question_and_choice_text(self):
+        """Words match question and choice texts, question texts first."""
+        self.assertEqual(search.search_ids("python"), [self.food.id, self.python.id])
+        self.assertEqual(search.search_ids("program lang"), [self.python.id])
+        self.assertEqual(search.search_ids("pizza"), [self.food.id])
+        self.assertEqual(search.search_ids("nothing"), [])
+        self.assertEqual(search.search_ids('"*'), [])
+
+    def test_index_follows_edits(self):
+        """Edited and deleted texts leave the index."""
+        choice = self.food.choice_set.get()
+        choice.choice_text = "Pretzel"
+        choice.save()
+        self.assertEqual(search.search_ids("pizza"), [])
+        self.assertEqual(search.search_ids("pretz"), [self.food.id])
+        self.food.delete()
+        self.assertEqual(search.search_ids("pretzel"), [])
+
+    def test_upcoming_questions(self):
+        """Upcoming questions are found by staff searches only."""
+        self.assertNotIn(self.upcoming.id, search.search_ids("upcoming"))
+        self.assertEqual(search.search_ids("upcoming", published_only=False),
+                         [self.upcoming.id])
+
+    def test_rebuild_index(self):
+        """The index can be rebuilt from the tables, triggers included."""
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER polls_search_choice_insert")
+        self.assertTrue(search.ensure_index())
+        self.assertFalse(search.ensure_index())
+        self.food.choice_set.create(choice_text="Nachos")
+        self.assertEqual(search.search_ids("nachos"), [self.food.id])
+
+    def test_search_view(self):
+        """The search page lists matching published questions."""
+        response = self.client.get(reverse('polls:search'), {'q': 'python'})
+        self.assertContains(response, "Best Python snack?")
+        self.assertNotContains(response, "Python upcoming?")
+        response = self.client.get(reverse('polls:search'), {'q': 'nothing'})
+        self.assertContains(response, "No polls match")
+
+    def test_admin_search(self):
+        """The admin searches upcoming questions through the index too."""
+        admin = User.objects.create_superuser("admin", "admin@mail.com", "tttttttt")
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'upcom'})
+        self.assertContains(response, "Python upcoming?")
+        self.assertNotContains(response, "Best Python snack?")
+
+    def test_matching_subquery(self):
+        """matching() filters through a subquery rather than a list of ids."""
+        for n in range(30):
+            create_question(f"Python poll {n}?", days=-1)
+        questions = Question.objects.filter(search.matching("python"))
+        self.assertEqual(questions.count(), 33)
+        self.assertLess(len(questions.query.sql_with_params()[1]), 5)
+        self.assertFalse(Question.objects.filter(search.matching('"*')).exists())
+
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.admin = User.objects.create_superuser("admin", "admin@mail.com", "tttttttt")
+        self.client.force_login(self.admin)
+        self.question = create_question("Admin question?", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="Yes")
+        self.voters = [User.objects.create_user(f"voter{n}", password="tttttttt") for n in range(3)]
+        for voter in self.voters:
+            Vote.cast(voter, self.choice)
+
+    def test_question_changelist_vote_totals(self):
+        """The question list shows vote totals and sorts by them."""
+        create_question("Quiet question?", days=-2)
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'o': '-6'})
+        self.assertEqual([question.total_votes for question in response.context['cl'].result_list],
+                         [3, 0])
+
+    def test_vote_changelist_queries(self):
+        """The vote list joins its relations instead of a query per row."""
+        url = reverse('admin:polls_vote_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for voter in range(3, 10):
+            Vote.cast(User.objects.create_user(f"voter{voter}"), self.choice)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertContains(response, "voter9")
+
+    def test_votes_are_read_only(self):
+        """Votes cannot be added or edited in the admin."""
+        self.assertEqual(self.client.get(reverse('admin:polls_vote_add')).status_code, 403)
+        vote = Vote.objects.get(user=self.voters[0])
+        url = reverse('admin:polls_vote_change', args=(vote.pk,))
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {'user': self.voters[1].pk, 'choice': self.choice.pk})
+        self.assertEqual(response.status_code, 403)
+
+    def test_delete_selected_releases_tallies(self):
+        """Deleting votes from the vote list takes them off the tallies."""
+        votes = Vote.objects.filter(user__in=self.voters[:2])
+        response = self.client.post(reverse('admin:polls_vote_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [vote.pk for vote in votes],
+            'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Vote.objects.count(), 1)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 1)
+
+    def test_date_hierarchy_probes(self):
+        """Date hierarchy periods come from range probes, newest last."""
+        old = Vote.objects.get(user=self.voters[0])
+        old.voted_at = old.voted_at - datetime.timedelta(days=800)
+        old.save()
+        queryset = admin.site._registry[Vote].get_queryset(None)
+        years = queryset.datetimes('voted_at', 'year')
+        self.assertEqual([year.year for year in years],
+                         [timezone.localtime(old.voted_at).year, timezone.localtime().year])
+        days = queryset.filter(user=self.voters[1]).datetimes('voted_at', 'day', 'DESC')
+        self.assertEqual([day.date() for day in days], [timezone.localdate()])
+        response = self.client.get(reverse('admin:polls_vote_changelist'))
+        self.assertContains(response, str(timezone.localtime().year))
+
+    def test_estimated_count(self):
+        """Large unfiltered lists use the table estimate, filtered ones a
+        bounded count."""
+        queryset = Vote.objects.order_by('pk')
+        paginator = EstimatedCountPaginator(queryset, 2)
+        paginator.exact_below = 1
+        self.assertGreaterEqual(paginator.count, 3)
+        paginator = EstimatedCountPaginator(queryset.filter(user=self.voters[0]), 2)
+        paginator.max_count = 2
+        self.assertEqual(paginator.count, 1)
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 3)
+
+
+@override_settings(POLLS_AUTH_CACHE_TIMEOUT=300)
+class SessionAuthTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user("cached", "cached@mail.com", "tttttttt")
+        self.question = create_question("Cached user?", days=-1)
+        self.url = reverse('polls:detail', args=(self.question.id,))
+        Question.catch_up()
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [query for query in queries if '"auth_user"' in query['sql']]
+
+    def test_session_user_cached(self):
+        """Logged-in requests read the user from the cache until it is saved."""
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+        self.user.is_active = False
+        self.user.save()
+        self.assertRedirects(self.client.get(self.url), f"{reverse('login')}?next={self.url}")
+
+    @override_settings(POLLS_AUTH_CACHE_TIMEOUT=0)
+    def test_session_user_not_cached(self):
+        """With no timeout, as with a local memory cache by default, every
+        request reads the user."""
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(len(self.user_queries()), 1)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        """Signed cookie sessions need no session query."""
+        self.client.force_login(self.user)
+        self.user_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+    def test_signup_logs_in(self):
+        """Signing up logs the new user in."""
+        self.client.post(reverse('signup'), {'username': 'newcomer', 'password1': 'Ku-polls-2545',
+                                             'password2': 'Ku-polls-2545'})
+        self.assertEqual(self.client.get(self.url).context['user'].username, 'newcomer')
+
+
+@override_settings(POLLS_VOTE_RATE_LIMIT={'ENABLED': True, 'STORE': 'local', 'IP': '5/60',
+                                          'USER': '3/60', 'QUESTION': '2/60'})
+class VoteRateLimitTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        ratelimit.get_store().clear()
+        self.user = User.objects.create_user("limited", "limited@mail.com", "tttttttt")
+        self.client.force_login(self.user)
+        self.question = create_question("Limited?", days=-1)
+        self.one = self.question.choice_set.create(choice_text="one")
+        self.two = self.question.choice_set.create(choice_text="two")
+        self.url = reverse('polls:vote', args=(self.question.id,))
+        Question.catch_up()
+
+    def test_token_bucket(self):
+        """A bucket allows a burst of votes, then refills at its rate."""
+        store = ratelimit.LocalStore()
+        limits = {'bucket': ratelimit.parse_rate('2/10')}
+        self.assertEqual(ratelimit.take(store, limits, now=100), 0)
+        self.assertEqual(ratelimit.take(store, limits, now=100), 0)
+        self.assertAlmostEqual(ratelimit.take(store, limits, now=101), 4)
+        self.assertEqual(ratelimit.take(store, limits, now=105), 0)
+
+    def test_question_limit(self):
+        """Flipping a vote over and over is turned away without a query."""
+        for choice in (self.one, self.two):
+            self.assertEqual(self.client.post(self.url, {'choice': choice.id}).status_code, 302)
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'choice': self.one.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(Vote.objects.get(user=self.user).choice, self.two)
+
+    def test_ip_limit(self):
+        """A flood from one address is turned away before the session is read."""
+        with self.settings(POLLS_VOTE_RATE_LIMIT={**settings.POLLS_VOTE_RATE_LIMIT, 'IP': '2/60'}):
+            for choice in (self.one, self.two):
+                self.client.post(self.url, {'choice': choice.id})
+            with self.assertNumQueries(0):
+                response = self.client.post(self.url, {'choice': self.one.id})
+        self.assertEqual(response.status_code, 429)
+
+    def test_cache_store(self):
+        """Buckets in the cache store are shared through the cache."""
+        with self.settings(POLLS_VOTE_RATE_LIMIT={**settings.POLLS_VOTE_RATE_LIMIT,
+                                                  'STORE': 'cache'}):
+            for _ in range(2):
+                self.client.post(self.url, {'choice': self.one.id})
+            self.assertEqual(self.client.post(self.url, {'choice': self.two.id}).status_code, 429)
+            self.assertEqual(len(caches['default'].get_many(
+                [f'polls:rate:user:{self.user.pk}:question:{self.question.id}'])), 1)
+
+    def test_unchanged_vote_skips_write(self):
+        """Resubmitting the stored choice writes nothing."""
+        Vote.cast(self.user, self.one)
+        with CaptureQueriesContext(connection) as queries:
+            vote, created = Vote.cast(self.user, self.one)
+        self.assertFalse(created)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(vote.changes, 0)
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user("watcher", "watcher@mail.com", "tttttttt")
+        self.question = create_question("Conditional?", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="one")
+        self.url = reverse('polls:results', args=(self.question.id,))
+        Question.catch_up()
+
+    def test_results_not_modified(self):
+        """Unchanged results answer revalidation with an empty 304."""
+        response = self.client.get(self.url)
+        self.assertIn('s-maxage', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+
+    def test_vote_changes_results_version(self):
+        """A vote, or a choice edit, gives the results page a new ETag."""
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.user, self.choice)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'id="votes{self.choice.id}">1<')
+        self.choice.choice_text = "renamed"
+        self.choice.save()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+    def test_vote_leaves_question_row(self):
+        """Votes do not write to the question row."""
+        with CaptureQueriesContext(connection) as queries:
+            Vote.cast(self.user, self.choice)
+        self.assertFalse([query for query in queries
+                          if query['sql'].startswith('UPDATE "polls_question"')])
+
+    @override_settings(POLLS_VOTE_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL': 60})
+    def test_flush_changes_results_version(self):
+        """A results page rendered before a tally flush is stale after it."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.user, self.choice)
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            get_tally_buffer().flush()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_index_not_modified(self):
+        """The index revalidates per user and changes with its questions."""
+        etag = self.client.get(reverse('polls:index'))['ETag']
+        self.assertEqual(self.client.get(reverse('polls:index'),
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.question.question_text = "Edited?"
+        self.question.save()
+        self.assertEqual(self.client.get(reverse('polls:index'),
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_messages_skip_validation(self):
+        """Pages showing a message are never answered with a 304."""
+        etag = self.client.get(self.url)['ETag']
+        self.client.force_login(self.user)
+        closed = create_question("Closed?", days=-5, end=-1)
+        self.client.get(reverse('polls:detail', args=(closed.id,)))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('ETag', response)
+
+
+class ReadApiTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user("reader", "reader@mail.com", "tttttttt")
+        self.questions = [create_question(f"Api question {n}?", days=-n - 1) for n in range(3)]
+        for question in self.questions:
+            question.choice_set.create(choice_text="yes")
+            question.choice_set.create(choice_text="no")
+        Vote.cast(self.user, self.questions[0].choice_set.first())
+        self.upcoming = create_question("Api upcoming?", days=3)
+        Question.catch_up()
+
+    def test_list_pages(self):
+        """The list pages through published questions, newest first."""
+        response = self.client.get(reverse('polls:api_questions'), {'size': 2})
+        data = json.loads(response.content)
+        self.assertEqual([item['id'] for item in data['questions']],
+                         [self.questions[0].id, self.questions[1].id])
+        self.assertEqual(set(data['questions'][0]),
+                         {'id', 'question_text', 'pub_date', 'end_date', 'state'})
+        data = json.loads(self.client.get(reverse('polls:api_questions'),
+                                          {'size': 2, 'after': data['next']}).content)
+        self.assertEqual([item['id'] for item in data['questions']], [self.questions[2].id])
+        self.assertIsNone(data['next'])
+
+    def test_batched_ids_fixed_queries(self):
+        """Any number of ids costs the same queries and keeps their order."""
+        url = reverse('polls:api_questions')
+        fields = {'fields': 'id,total_votes,choices.votes'}
+        with self.assertNumQueries(2):
+            self.client.get(url, {'ids': str(self.questions[1].id), **fields})
+        ids = [self.questions[2].id, self.questions[0].id, self.upcoming.id, 999]
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'ids': ','.join(map(str, ids)), **fields})
+        data = json.loads(response.content)
+        self.assertEqual(data['questions'], [
+            {'id': self.questions[2].id, 'total_votes': 0, 'choices': [{'votes': 0}, {'votes': 0}]},
+            {'id': self.questions[0].id, 'total_votes': 1, 'choices': [{'votes': 1}, {'votes': 0}]},
+        ])
+        self.assertEqual(data['missing'], [self.upcoming.id, 999])
+
+    def test_detail_and_results(self):
+        """Detail lists the choices, results their votes."""
+        question = self.questions[0]
+        data = json.loads(self.client.get(reverse('polls:api_question', args=(question.id,))).content)
+        self.assertEqual([choice['choice_text'] for choice in data['choices']], ['yes', 'no'])
+        data = json.loads(self.client.get(reverse('polls:api_results', args=(question.id,))).content)
+        self.assertEqual(data['total_votes'], 1)
+        self.assertEqual(data['choices'][0], {'id': question.choice_set.first().id,
+                                              'choice_text': 'yes', 'votes': 1})
+        self.assertEqual(self.client.get(reverse('polls:api_question',
+                                                 args=(self.upcoming.id,))).status_code, 404)
+
+    def test_bad_requests(self):
+        """Unknown fields and malformed or too many ids are rejected."""
+        url = reverse('polls:api_questions')
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'a,b'}).status_code, 400)
+        with self.settings(POLLS_API_MAX_IDS=2):
+            self.assertEqual(self.client.get(url, {'ids': '1,2,3'}).status_code, 400)
+
+
+class StartupTests(TestCase):
+
+    def test_warm_templates(self):
+        """Warm-up compiles the polls and registration templates into the
+        loader cache."""
+        names = warmup.warm_templates()
+        self.assertIn('polls/results.html', names)
+        self.assertIn('registration/login.html', names)
+        self.assertNotIn('admin/base.html', names)
+        engine = engines.all()[0].engine
+        if settings.DEBUG:
+            self.skipTest('The cached loader is configured outside DEBUG')
+        self.assertIn('polls/results.html', engine.template_loaders[0].get_template_cache)
+
+    def test_hashed_static_files(self):
+        """Collected files get hashed names served with far-future caching."""
+        with tempfile.TemporaryDirectory() as root, self.settings(
+                STATIC_ROOT=root, STORAGES={**settings.STORAGES, 'staticfiles': {
+                    'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'}}):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            url = static('polls/style.css')
+            self.assertRegex(url, r'/polls/style\.[0-9a-f]{12}\.css$')
+            request = RequestFactory().get(url)
+            response = site_view.static(request, url[url.index('polls/'):])
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertIn('max-age=31536000', response['Cache-Control'])
+            response = site_view.static(request, 'polls/style.css')
+            self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_public_settings_without_sampling(self):
+        """Public nodes leave instrumentation off when nothing is sampled."""
+        import mysite.settings
+        import mysite.settings_public
+        rate = mysite.settings.POLLS_INSTRUMENTATION_SAMPLE_RATE
+        try:
+            mysite.settings.POLLS_INSTRUMENTATION_SAMPLE_RATE = 0.0
+            public = importlib.reload(mysite.settings_public)
+            self.assertNotIn('polls.instrumentation.InstrumentationMiddleware', public.MIDDLEWARE)
+            self.assertIn('django.middleware.csrf.CsrfViewMiddleware', public.MIDDLEWARE)
+            self.assertEqual(public.TEMPLATES[0]['BACKEND'], 'django.template.backends.django.DjangoTemplates')
+            self.assertNotIn('django.contrib.admin', public.INSTALLED_APPS)
+            mysite.settings.POLLS_INSTRUMENTATION_SAMPLE_RATE = 0.5
+            public = importlib.reload(mysite.settings_public)
+            self.assertIn('polls.instrumentation.InstrumentationMiddleware', public.MIDDLEWARE)
+        finally:
+            mysite.settings.POLLS_INSTRUMENTATION_SAMPLE_RATE = rate
+            importlib.reload(mysite.settings_public)
+
+
+class WorkerStartupTests(TestCase):
+
+    def setUp(self):
+        question = create_question("Forked?", days=-1)
+        self.choice = question.choice_set.create(choice_text="one")
+
+    def test_profile_imports(self):
+        """The import profile lists every module with its times."""
+        imports = startup.profile_imports('json')
+        self.assertIn('json', [item['module'] for item in imports])
+        self.assertTrue(all(item['cumulative_ms'] >= item['self_ms'] >= 0 for item in imports))
+        out = io.StringIO()
+        call_command('profile_startup', 'json', '--top', '3', '--json', stdout=out)
+        self.assertLessEqual(len(json.loads(out.getvalue())['json']['slowest']), 3)
+
+    @override_settings(POLLS_VOTE_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL': 60})
+    def test_fork_hooks(self):
+        """The master writes its buffered tallies before forking; a worker
+        drops its inherited copy."""
+        self.addCleanup(gc.unfreeze)
+        get_tally_buffer().add({self.choice.pk: 1})
+        startup.before_fork()
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 1)
+        inherited = get_tally_buffer()
+        inherited.add({self.choice.pk: 1})
+        startup.after_fork()
+        self.assertIsNot(get_tally_buffer(), inherited)
+        self.assertEqual(get_tally_buffer().pending(self.choice.pk), 0)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 1)
@@ -0,0 +1,217 @@
+"""Streaming import and export of polls data.
+
+Records use the shape of the ``data/*.json`` fixtures, one per line in JSON
+Lines files (``{"model": "polls.question", "pk": 6, "fields": {...}}``),
+or one CSV file per model with a ``pk`` column followed by the field
+names. Records are read one at a time and written with bulk_create in
+batches, so memory use does not grow with the size of the file.
+"""
+import csv
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connections, router, transaction
+
+from . import cache
+from .models import Choice, Question, Vote
+
+# Models in dependency order.
+MODELS = {
+    'auth.user': User,
+    'polls.question': Question,
+    'polls.choice': Choice,
+    'polls.vote': Vote,
+}
+
+# Derived columns that are rebuilt after an import rather than copied.
+SKIPPED_FIELDS = {'vote_count', 'state', 'next_transition', 'modified_at'}
+
+
+class InvalidRecord(ValueError):
+    """A record that cannot be written, with the place it was read from."""
+
+
+def model_label(name):
+    """Return the full label of a model name such as 'question'."""
+    name = name.lower()
+    if name in MODELS:
+        return name
+    for label in MODELS:
+        if label.split('.')[1] == name:
+            return label
+    raise ValueError(f'Unknown model {name!r}, expected one of {", ".join(MODELS)}.')
+
+
+def fields(label):
+    """Return the exported fields of a model, without the primary key."""
+    return [field for field in MODELS[label]._meta.concrete_fields
+            if not field.primary_key and field.name not in SKIPPED_FIELDS]
+
+
+def read_jsonl(stream):
+    """Yield (label, pk, fields, line number) for every line of a JSON Lines
+    stream."""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            label, pk, values = model_label(record['model']), record.get('pk'), record['fields']
+        except (ValueError, KeyError, TypeError) as error:
+            raise ValueError(f'Line {number}: {error}') from error
+        yield label, pk, values, number
+
+
+def read_csv(stream, label):
+    """Yield (label, pk, fields, line number) for every row of a CSV stream
+    of one model."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        pk = row.pop('pk', None) or None
+        yield label, pk, {name: (value if value != '' else None)
+                          for name, value in row.items()}, reader.line_num
+
+
+def _instance(label, pk, values):
+    model = MODELS[label]
+    kwargs = {}
+    for field in fields(label):
+        if field.name in values:
+            value = values[field.name]
+            kwargs[field.attname] = None if value is None else field.to_python(value)
+    if label == 'polls.vote' and 'voted_at' not in values:
+        # Votes recorded without a time keep an unknown one, not the import time.
+        kwargs['voted_at'] = None
+    if pk is not None:
+        kwargs[model._meta.pk.attname] = model._meta.pk.to_python(pk)
+    return model(**kwargs)
+
+
+def _describe(label, batch):
+    """Name a batch of queued records by where they were read from."""
+    first, last = batch[0][0], batch[-1][0]
+    if first is None:
+        return f'Batch of {len(batch)} {label} records'
+    if first == last:
+        return first
+    return f'Batch of {len(batch)} {label} records from {first} to {last}'
+
+
+class Importer:
+    """Batches records per model and writes them with bulk_create.
+
+    Flushing a batch first flushes the pending batches of the models it
+    depends on, so foreign keys always point at rows already written.
+    """
+
+    def __init__(self, batch_size=5000, ignore_conflicts=False):
+        self.batch_size = batch_size
+        self.ignore_conflicts = ignore_conflicts
+        self.pending = {label: [] for label in MODELS}
+        self.counts = {label: 0 for label in MODELS}
+        self.voted_questions = set()
+
+    def add(self, label, pk, values, source=None):
+        """Queue one record, writing its batch when full. source, such as
+        'votes.jsonl line 3', names the record in errors."""
+        self.pending[label].append((source, _instance(label, pk, values)))
+        if len(self.pending[label]) >= self.batch_size:
+            self.flush(label)
+
+    def flush(self, label):
+        """Write the queued batch of label and of the models before it."""
+        for dependency in MODELS:
+            batch = self.pending[dependency]
+            if batch:
+                self.pending[dependency] = []
+                try:
+                    with transaction.atomic():
+                        self._write(dependency, batch)
+                except IntegrityError as error:
+                    raise InvalidRecord(f'{_describe(dependency, batch)}: {error}') from error
+            if dependency == label:
+                break
+
+    def _write(self, label, batch):
+        if label == 'polls.vote':
+            questions = dict(Choice.objects.filter(pk__in={vote.choice_id for _, vote in batch})
+                             .values_list('pk', 'question_id'))
+            for source, vote in batch:
+                if vote.choice_id not in questions:
+                    raise InvalidRecord(f'{source or "Vote"}: unknown choice {vote.choice_id}.')
+                if vote.question_id is None:
+                    vote.question_id = questions[vote.choice_id]
+                elif vote.question_id != questions[vote.choice_id]:
+                    raise InvalidRecord(f'{source or "Vote"}: choice {vote.choice_id} is not '
+                                        f'a choice of question {vote.question_id}.')
+                self.voted_questions.add(vote.question_id)
+        MODELS[label].objects.bulk_create([instance for _, instance in batch],
+                                          ignore_conflicts=self.ignore_conflicts)
+        self.counts[label] += len(batch)
+
+    def _reset_sequences(self):
+        # bulk_create inserts the primary keys of the records as they are,
+        # so sequences (on PostgreSQL and Oracle) must move past them before
+        # the next insert, as loaddata does.
+        aliases = {}
+        for label, count in self.counts.items():
+            if count:
+                aliases.setdefault(router.db_for_write(MODELS[label]), []).append(MODELS[label])
+        for alias, models in aliases.items():
+            connection = connections[alias]
+            statements = connection.ops.sequence_reset_sql(no_style(), models)
+            if statements:
+                with connection.cursor() as cursor:
+                    for statement in statements:
+                        cursor.execute(statement)
+
+    def finish(self, rebuild_tallies=True):
+        """Write what is left, move sequences past the imported keys,
+        recount tallies and drop stale caches."""
+        self.flush('polls.vote')
+        self._reset_sequences()
+        if rebuild_tallies and (self.counts['polls.vote'] or self.counts['polls.choice']):
+            Choice.rebuild_tallies()
+        if self.counts['polls.question']:
+            Question.sync_states()
+            cache.invalidate_index()
+            cache.invalidate_lifecycle()
+        cache.invalidate_results(self.voted_questions)
+        return self.counts
+
+
+def _rows(label, batch_size):
+    names = ['pk'] + [field.name for field in fields(label)]
+    return names, MODELS[label].objects.order_by('pk').values_list(*names) \
+        .iterator(chunk_size=batch_size)
+
+
+def write_jsonl(stream, labels, batch_size=5000):
+    """Write every row of the given models to a JSON Lines stream.
+    Return the number of rows written."""
+    written = 0
+    for label in labels:
+        names, rows = _rows(label, batch_size)
+        for row in rows:
+            stream.write(json.dumps({'model': label, 'pk': row[0],
+                                     'fields': dict(zip(names[1:], row[1:]))},
+                                    cls=DjangoJSONEncoder) + '\n')
+            written += 1
+    return written
+
+
+def write_csv(stream, label, batch_size=5000):
+    """Write every row of one model to a CSV stream. Return the number of
+    rows written."""
+    names, rows = _rows(label, batch_size)
+    writer = csv.writer(stream)
+    writer.writerow(names)
+    written = 0
+    for row in rows:
+        writer.writerow(['' if value is None
+                         else value.isoformat() if hasattr(value, 'isoformat')
+                         else value for value in row])
+        written += 1
+    return written
@@ -1,11 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 app_name = 'polls'
-urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
-    path('<int:question_id>/vote/', views.vote, name='vote'),
-]
+
+
+def routes(async_names=()):
+    """Return the polls routes, using the async view of every route whose
+    name is in async_names."""
+    def pick(name, sync_view, async_view):
+        return async_view if name in async_names else sync_view
+
+    return [
+        path('', pick('index', views.IndexView.as_view(),
+                      async_views.AsyncIndexView.as_view()), name='index'),
+        path('archive/', views.ArchiveView.as_view(), name='archive'),
+        path('search/', views.search_view, name='search'),
+        path('<int:pk>/', pick('detail', views.DetailView.as_view(),
+                               async_views.AsyncDetailView.as_view()), name='detail'),
+        path('<int:pk>/results/', pick('results', views.ResultsView.as_view(),
+                                       async_views.AsyncResultsView.as_view()), name='results'),
+        path('<int:question_id>/vote/', pick('vote', views.vote, async_views.vote), name='vote'),
+        path('<int:pk>/results/stream/', async_views.results_stream, name='results_stream'),
+        path('metrics/', views.metrics, name='metrics'),
+        path('api/votes/bulk/', api.bulk_vote, name='bulk_vote'),
+        path('api/analytics/', api.vote_analytics, name='analytics'),
+        path('api/v1/questions/', api.questions, name='api_questions'),
+        path('api/v1/questions/<int:pk>/', api.question, name='api_question'),
+        path('api/v1/questions/<int:pk>/results/', api.question_results, name='api_results'),
+    ]
+
+
+urlpatterns = routes(settings.POLLS_ASYNC_VIEWS)
@@ -1,14 +1,22 @@
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseRedirect, JsonResponse)
+from django.conf import settings
+from django.db.models import Q
 from django.contrib import messages
 from django.urls import reverse
+from django.utils.cache import add_never_cache_headers
 from django.views import generic
-from django.utils import timezone
+from . import cache, conditional, events, instrumentation, ratelimit, search
+from .api import _has_token
+from .buffer import get_tally_buffer
 from .models import Choice, Question, Vote
+from .pagination import keyset_page
+from .routers import ReplicaReadMixin, is_pinned, pin_to_primary
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 
-class IndexView(generic.ListView):
+class IndexView(ReplicaReadMixin, generic.ListView):
     """Index page of application."""
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
@@ -17,10 +25,103 @@ class IndexView(generic.ListView):
         """
         Return the last five published questions (not including those set to be
         published in the future).
+        The list is cached until a question changes state, except for
+        clients pinned to the primary.
         """
-        return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        ).order_by('-pub_date')[:5]
+        Question.catch_up()
+        pinned = is_pinned(self.request)
+        version = cache.version(cache.INDEX)
+        questions = None if pinned else cache.get_index(version)
+        if questions is None:
+            questions = list(Question.objects.exclude(
+                state=Question.State.SCHEDULED
+            ).order_by('-pub_date')[:5])
+            if not pinned:
+                cache.set_index(version, questions, float('inf'))
+        return questions
+
+    def get(self, request, *args, **kwargs):
+        """Answer revalidations with a 304 when the listed questions are
+        unchanged. Pages with pending messages are never cached."""
+        if messages.get_messages(request):
+            response = super().get(request, *args, **kwargs)
+            add_never_cache_headers(response)
+            return response
+        self.object_list = self.get_queryset()
+        private = request.user.is_authenticated
+        etag = conditional.index_etag(self.object_list, request.user)
+        response = conditional.not_modified(request, etag, private=private)
+        if response is None:
+            response = self.render_to_response(self.get_context_data())
+            conditional.add_validators(response, etag, private=private)
+        return response
+
+
+class ArchiveView(ReplicaReadMixin, generic.View):
+    """Every published question, newest first, a page at a time."""
+    # Status filters. Each one is served by an index on its own: 'all' by
+    # (pub_date, id), the others by (state, pub_date, id). Upcoming polls
+    # are for staff.
+    STATUSES = {
+        'all': ~Q(state=Question.State.SCHEDULED),
+        'open': Q(state=Question.State.OPEN),
+        'closed': Q(state=Question.State.CLOSED),
+        'upcoming': Q(state=Question.State.SCHEDULED),
+    }
+
+    def get(self, request):
+        """Render the page after the after cursor or before the before
+        cursor, as HTML or, with format=json, as JSON."""
+        status = request.GET.get('status', 'all')
+        if status not in self.STATUSES or (status == 'upcoming' and not request.user.is_staff):
+            raise Http404('Unknown status.')
+        try:
+            size = min(int(request.GET.get('size', settings.POLLS_ARCHIVE_PAGE_SIZE)),
+                       settings.POLLS_ARCHIVE_MAX_PAGE_SIZE)
+            Question.catch_up()
+            page = keyset_page(Question.objects.filter(self.STATUSES[status]),
+                               max(size, 1), after=request.GET.get('after'),
+                               before=request.GET.get('before'))
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        links = {}
+        for name, key, cursor in (('next', 'after', page.next_cursor),
+                                  ('previous', 'before', page.previous_cursor)):
+            if cursor is not None:
+                query = request.GET.copy()
+                query.pop('after', None)
+                query.pop('before', None)
+                query[key] = cursor
+                links[name] = f'{request.path}?{query.urlencode()}'
+            else:
+                links[name] = None
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'results': [{
+                    'id': question.pk,
+                    'question_text': question.question_text,
+                    'pub_date': question.pub_date,
+                    'end_date': question.end_date,
+                    'state': question.state,
+                    'url': reverse('polls:detail', args=(question.pk,)),
+                } for question in page.items],
+                **links,
+            })
+        return render(request, 'polls/archive.html', {
+            'questions': page.items, 'status': status,
+            'statuses': [name for name in self.STATUSES
+                         if name != 'upcoming' or request.user.is_staff],
+            'next_url': links['next'], 'previous_url': links['previous'],
+        })
+
+
+def search_view(request):
+    """Search published questions by the words of their question and
+    choice texts."""
+    query = request.GET.get('q', '').strip()
+    Question.catch_up()
+    questions = search.search(query, settings.POLLS_SEARCH_RESULTS) if query else []
+    return render(request, 'polls/search.html', {'query': query, 'questions': questions})
 
 
 class DetailView(LoginRequiredMixin, generic.DetailView):
@@ -30,51 +131,81 @@ class DetailView(LoginRequiredMixin, generic.DetailView):
 
     def get_queryset(self):
         """
-        Excludes any questions that aren't published yet.
+        Return questions with their choices prefetched. Unpublished questions
+        are kept so get can redirect with a message instead of a 404.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.prefetch_related('choice_set')
 
     def get(self, request, pk):
-        """Return different pages in accordance to can_vote and is_published"""
-        question = get_object_or_404(Question, pk=pk)
-        user = request.user
-        if not question.is_published():
+        """Return different pages in accordance to the question state"""
+        Question.catch_up()
+        question = self.get_object()
+        if question.state == Question.State.SCHEDULED:
             messages.error(request, 'This poll not publish yet.')
             return HttpResponseRedirect(reverse('polls:index'))
-        elif not question.can_vote():
+        elif question.state == Question.State.CLOSED:
             messages.error(request, 'This poll is ended.')
             return HttpResponseRedirect(reverse('polls:index'))
         else:
-            check = ""
-            user_vote = Vote.objects.filter(user=user)
-            for select in user_vote:
-                if select.question == question:
-                    check = select.choice.choice_text
+            check = Vote.objects.filter(
+                user=request.user, question=question
+            ).values_list('choice_id', flat=True).first()
             return render(request, 'polls/detail.html',
                           {'question': question, 'check': check, })
 
 
-class ResultsView(generic.DetailView):
+class ResultsView(ReplicaReadMixin, generic.DetailView):
     """Result page of the application."""
     model = Question
     template_name = 'polls/results.html'
 
     def get(self, request, pk):
         """Return result page if can_vote method returns True.
-        If not then redirect to results page."""
+        If not then redirect to results page.
+        Pages without pending messages are served from the results cache
+        and answer revalidations with a 304 while its version is unchanged.
+        Clients pinned to the primary skip the results cache, which may hold
+        a page rendered from a replica that is behind."""
+        has_messages = bool(messages.get_messages(request))
+        pinned = is_pinned(request)
+        version = cache.results_version(pk)
+        etag = conditional.results_etag(pk, version, primary=pinned)
+        if not has_messages and not pinned:
+            content = cache.get_results_page(pk, version)
+            if content is not None:
+                return conditional.not_modified(request, etag) or \
+                    conditional.add_validators(HttpResponse(content), etag)
+        Question.catch_up()
         question = get_object_or_404(Question, pk=pk)
-        if not question.is_published():
+        if question.state == Question.State.SCHEDULED:
             messages.error(request, 'This poll not publish yet.')
             return HttpResponseRedirect(reverse('polls:index'))
-        else:
-            return render(request, 'polls/results.html',
-                          {'question': question})
+        if not has_messages:
+            response = conditional.not_modified(request, etag)
+            if response is not None:
+                return response
+        response = render(request, 'polls/results.html', {
+            'question': question, 'live_results': events.live(request)})
+        if has_messages:
+            add_never_cache_headers(response)
+            return response
+        if not pinned:
+            cache.set_results_page(pk, version, response.content)
+        return conditional.add_validators(response, etag)
 
 
 def vote(request, question_id):
     """Add vote to choice of the current question."""
+    throttled = ratelimit.throttle(request, question_id)
+    if throttled is not None:
+        return throttled
     user = request.user
+    Question.catch_up()
     question = get_object_or_404(Question, pk=question_id)
+    if question.state != Question.State.OPEN:
+        messages.error(request, 'This poll is ended.' if question.state == Question.State.CLOSED
+                       else 'This poll not publish yet.')
+        return HttpResponseRedirect(reverse('polls:index'))
     try:
         selected_choice = question.choice_set.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
@@ -83,14 +214,27 @@ def vote(request, question_id):
             'error_message': "You didn't select a choice.",
         })
     else:
-        vote_select = Vote.objects.filter(user=user)
-        for select in vote_select:
-            if select.question == question:
-                select.choice = selected_choice
-                select.save()
-                return HttpResponseRedirect(reverse('polls:results',
-                                                    args=(question.id,)))
-        new_vote = Vote.objects.create(user=user, choice=selected_choice)
-        new_vote.save()
-        return HttpResponseRedirect(reverse('polls:results',
-                                            args=(question.id,)))
+        Vote.cast(user, selected_choice)
+        return pin_to_primary(HttpResponseRedirect(reverse('polls:results',
+                                                           args=(question.id,))))
+
+
+def metrics(request):
+    """Return the per-view request metrics to staff users, or to a
+    scraper sending POLLS_METRICS_TOKEN as a bearer token. The format
+    query parameter picks Prometheus text instead of JSON."""
+    if not (request.user.is_staff or _has_token(request, settings.POLLS_METRICS_TOKEN)):
+        return HttpResponse(status=403)
+    buffer = get_tally_buffer()
+    if request.GET.get('format') == 'prometheus':
+        text = instrumentation.registry.prometheus()
+        if buffer is not None:
+            for name, value in buffer.metrics().items():
+                if isinstance(value, (bool, int, float)):
+                    text += f'polls_vote_buffer_{name} {float(value)}\n'
+        return HttpResponse(text, content_type='text/plain; version=0.0.4')
+    return JsonResponse({
+        'sample_rate': settings.POLLS_INSTRUMENTATION_SAMPLE_RATE,
+        'views': instrumentation.registry.snapshot(),
+        'vote_buffer': buffer.metrics() if buffer is not None else None,
+    })
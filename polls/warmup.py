@@ -0,0 +1,38 @@
+"""Warm-up of new server processes."""
+import os
+
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.urls import get_resolver
+
+WARM_PREFIXES = ('polls/', 'registration/')
+
+
+def warm_templates(prefixes=WARM_PREFIXES):
+    """Compile every template whose name starts with one of prefixes into
+    the loader cache of each Django template engine, so the first
+    requests of a process do not parse them. Return the names compiled."""
+    names = set()
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        found = set()
+        for loader in engine.engine.template_loaders:
+            for directory in loader.get_dirs():
+                for root, _, files in os.walk(directory):
+                    for file in files:
+                        name = os.path.relpath(os.path.join(root, file), directory)
+                        name = name.replace(os.sep, '/')
+                        if name.startswith(prefixes) and name.endswith('.html'):
+                            found.add(name)
+        for name in sorted(found):
+            engine.get_template(name)
+        names |= found
+    return sorted(names)
+
+
+def warm_up():
+    """Import every view through the root URLconf and compile the polls
+    and registration templates. Return the template names compiled."""
+    get_resolver().url_patterns
+    return warm_templates()